@@ -1,13 +1,23 @@
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
-import json
-import numpy as np
 
-from config import K_TOPICS, V_SIZE, N_DOCS, ALPHA_PARAM, SIM_DATE, vocabulary, DOC_LENGTH, DB_NAME
-from db_manager import record_simulation_parameters, bulk_insert_documents, fetch_documents_for_analysis, bulk_insert_analysis_results, update_simulation_results, initialize_database
-from stat_sim import create_phi_matrix, generate_documents, train_and_predict_lda, calculate_cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
+from config import K_TOPICS, N_DOCS, ALPHA_PARAM, DOC_LENGTH, DB_NAME
+from db_manager import initialize_database, fetch_run_metrics
+from main_run import run_pipeline, RunCancelled
+
+# 后台线程消息队列的轮询间隔 (毫秒)
+POLL_INTERVAL_MS = 100
+
+# 各阶段在状态栏中的显示名称
+STAGE_LABELS = {
+    'generate': "正在生成并入库文档",
+    'fetch': "正在读取文档-词频矩阵",
+    'train': "正在训练 LDA 模型",
+    'evaluate': "正在对齐主题并计算相似度",
+}
 
 class SimpleLDAApp(tk.Tk):
     def __init__(self):
@@ -43,6 +53,10 @@ class SimpleLDAApp(tk.Tk):
                                  command=self.run_simulation_and_show_result, 
                                  fg="green", font=("Arial", 10, "bold"), **btn_style)
         self.btn_run.pack(side="left", padx=5, pady=5)
+
+        self.btn_cancel = tk.Button(toolbar, text="■ 取消运行", command=self.cancel_simulation,
+                                    state="disabled", **btn_style)
+        self.btn_cancel.pack(side="left", padx=5, pady=5)
         
         tk.Button(toolbar, text="退出系统", command=self.quit, bg="#ffcccc").pack(side="right", padx=5, pady=5)
 
@@ -79,67 +93,83 @@ class SimpleLDAApp(tk.Tk):
         right_panel = tk.Frame(self.paned_window, bg="#f0f0f0")
         self.status_label = tk.Label(right_panel, text="点击 '运行 LDA 模拟' 开始验证", font=("Arial", 14), bg="#f0f0f0")
         self.status_label.pack(expand=True)
+        self.progress_bar = ttk.Progressbar(right_panel, orient="horizontal", length=360, mode="determinate")
+        self.progress_bar.pack(pady=(0, 40))
         self.paned_window.add(right_panel)
 
     def run_simulation_and_show_result(self):
+        self.status_label.config(text="正在运行中，请等待...", fg="orange")
+        self.lbl_result_score.config(text="计算中...")
+        self.progress_bar.config(value=0)
+        self.btn_run.config(state="disabled")
+        self.btn_cancel.config(state="normal")
+
+        # 模拟流程在后台线程中运行，通过队列把进度发回主线程，由 after() 轮询刷新界面
+        self.message_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.worker = threading.Thread(target=self._simulation_worker, daemon=True)
+        self.worker.start()
+        self.after(POLL_INTERVAL_MS, self.poll_worker_messages)
+
+    def cancel_simulation(self):
+        self.cancel_event.set()
+        self.btn_cancel.config(state="disabled")
+        self.status_label.config(text="正在取消，等待当前步骤结束...", fg="orange")
+
+    def _simulation_worker(self):
+        # 后台线程: 不直接操作 Tk 控件，只向队列发送消息
         try:
-            self.status_label.config(text="正在运行中，请等待...", fg="orange")
-            self.lbl_result_score.config(text="计算中...")
-            self.btn_run.config(state="disabled")
-
-            # 1. 记录实验参数
-            params_tuple = (K_TOPICS, V_SIZE, N_DOCS, ALPHA_PARAM, str(SIM_DATE))
-            current_run_id = record_simulation_parameters(params_tuple)
-            
-            if current_run_id is None:
-                messagebox.showerror("错误", "无法获取 run_id，请检查数据库连接。")
-                return
-
-            # 2. 模拟数据生成
-            phi_matrix = create_phi_matrix(K_TOPICS, V_SIZE)
-            generated_data = generate_documents(phi_matrix, vocabulary, current_run_id, ALPHA_PARAM, N_DOCS, DOC_LENGTH)
-            
-            # 3. 批量入库
-            success = bulk_insert_documents(generated_data)
-            if not success:
-                messagebox.showerror("错误", "文档入库失败。")
-                return
-            
-            # 4. 模型训练与验证
-            analysis_data = fetch_documents_for_analysis(current_run_id)
-            texts = [d['text'] for d in analysis_data]
-            vectorizer = CountVectorizer(vocabulary=vocabulary)
-            dtm = vectorizer.fit_transform(texts)
-            theta_pred_matrix = train_and_predict_lda(dtm, dtm, K_TOPICS)
-            
-            # 5. 计算相似度并组装结果
-            analysis_results = []
-            for i, doc_data in enumerate(analysis_data):
-                true_theta = doc_data['true_theta']
-                # 注意：这里直接将 NumPy 数组转换为列表
-                pred_theta_vector = theta_pred_matrix[i] 
-                similarity = calculate_cosine_similarity(true_theta, pred_theta_vector.tolist())
-                
-                result_tuple = (doc_data['doc_id'], current_run_id, json.dumps(pred_theta_vector.tolist()), similarity)
-                analysis_results.append(result_tuple)
-            
-            # 6. 存档并更新总分
-            bulk_insert_analysis_results(analysis_results)
-            avg_similarity = np.mean([r[3] for r in analysis_results])
-            update_simulation_results(current_run_id, avg_similarity)
-            
-            # 7. 更新 UI
+            current_run_id, avg_similarity = run_pipeline(
+                progress=lambda stage, done, total: self.message_queue.put(('progress', stage, done, total)),
+                should_cancel=self.cancel_event.is_set)
+            # 阶段指标已由 run_pipeline 写入 run_metrics 表，读回来显示在结果对话框中
+            metrics = fetch_run_metrics(current_run_id)
+            self.message_queue.put(('done', current_run_id, avg_similarity, metrics))
+        except RunCancelled:
+            self.message_queue.put(('cancelled',))
+        except Exception as e:
+            self.message_queue.put(('error', e))
+
+    def poll_worker_messages(self):
+        try:
+            while True:
+                message = self.message_queue.get_nowait()
+                if message[0] == 'progress':
+                    self.show_progress(*message[1:])
+                else:
+                    self.finish_simulation(message)
+                    return
+        except queue.Empty:
+            pass
+        self.after(POLL_INTERVAL_MS, self.poll_worker_messages)
+
+    def show_progress(self, stage, done, total):
+        text = f"{STAGE_LABELS.get(stage, stage)}: {done} / {total}"
+        if stage == 'train' and total > 1:
+            text = f"{STAGE_LABELS['train']}: 第 {done} / {total} 轮迭代"
+        self.status_label.config(text=text, fg="orange")
+        self.progress_bar.config(maximum=max(total, 1), value=done)
+
+    def finish_simulation(self, message):
+        self.btn_run.config(state="normal") # 恢复按钮状态
+        self.btn_cancel.config(state="disabled")
+        kind = message[0]
+        if kind == 'done':
+            _, current_run_id, avg_similarity, metrics = message
             self.lbl_result_score.config(text=f"{avg_similarity:.4f}")
             self.status_label.config(text=f"模拟完成，平均相似度: {avg_similarity:.4f}", fg="green")
-            messagebox.showinfo("成功", f"模拟完成！\n平均余弦相似度: {avg_similarity:.4f}")
-
-        except Exception as e:
+            timing = "\n".join(f"  {record['stage']}: {record['wall_seconds']:.2f}s" for record in metrics)
+            total = sum(record['wall_seconds'] for record in metrics)
+            messagebox.showinfo("成功", f"模拟完成！(run_id {current_run_id})\n平均余弦相似度: {avg_similarity:.4f}\n\n"
+                                      f"各阶段用时 (共 {total:.2f}s):\n{timing}")
+        elif kind == 'cancelled':
+            self.lbl_result_score.config(text="--")
+            self.status_label.config(text="运行已取消，该 run 已标记为 aborted", fg="gray")
+        else:
+            e = message[1]
             self.status_label.config(text=f"运行失败，错误: {str(e)[:50]}...", fg="red")
             self.lbl_result_score.config(text="错误")
             messagebox.showerror("运行错误", f"运行过程中发生错误:\n{e}")
-            
-        finally:
-            self.btn_run.config(state="normal") # 恢复按钮状态
 
 if __name__ == "__main__":
     app = SimpleLDAApp()
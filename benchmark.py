@@ -0,0 +1,349 @@
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+import numpy as np
+
+import db_manager
+from config import K_TOPICS, V_SIZE, ALPHA_PARAM, DOC_LENGTH, build_vocabulary
+from db_manager import (get_db_connection, initialize_database, db_session, transaction, stream_insert_documents,
+                        fetch_document_term_matrix)
+from stat_sim import (create_phi_matrix, generate_documents, iter_document_batches, generate_count_matrix,
+                      train_and_predict_lda, GENERATOR_VERSION)
+from evaluation import evaluate_theta, evaluate_likelihood, iter_row_chunks
+from corpus_cache import iter_corpus_batches
+from metrics import peak_rss_kb
+
+# 文档生成性能基准：比较批量词频引擎与逐词 (保留词序) 引擎的吞吐量
+def bench_generate(n_docs=3000, doc_length=DOC_LENGTH, repeats=3, seed=0):
+    phi_matrix = create_phi_matrix(K_TOPICS, V_SIZE)
+    results = {}
+    for label, exact_order in [("batched", False), ("exact_order", True)]:
+        timings = []
+        for r in range(repeats):
+            start = time.perf_counter()
+            generate_documents(phi_matrix, build_vocabulary(V_SIZE, K_TOPICS), 0, ALPHA_PARAM, n_docs, doc_length,
+                               exact_order=exact_order, seed=seed + r)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        results[label] = n_docs / best
+        print(f"[generate_documents:{label}] N={n_docs}, L={doc_length}: {best:.3f}s, {n_docs / best:,.0f} docs/sec")
+    return results
+
+# 入库性能基准:
+#   per_call_connection: 旧方式，一次 db_manager 调用新开一个连接，默认 PRAGMA (DELETE 日志)，全部文档一次 executemany 后提交
+#   per_batch_connection: 流式入库但不复用连接，每批新开连接并提交 (默认 PRAGMA)
+#   session: 单会话 + 调优 PRAGMA (WAL) + 单事务流式入库
+def bench_insert(n_docs=20000, doc_length=DOC_LENGTH, batch_size=100, seed=0):
+    phi_matrix = create_phi_matrix(K_TOPICS, V_SIZE)
+    batches = list(iter_document_batches(phi_matrix, build_vocabulary(V_SIZE, K_TOPICS), 1, ALPHA_PARAM, n_docs, doc_length,
+                                         seed=seed, block_size=batch_size))
+    sql = "INSERT INTO documents_data (run_id, simulated_text, true_theta_vector, word_counts) VALUES (?, ?, ?, ?)"
+    results = {}
+    original_db_name = db_manager.DB_NAME
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            rows = [row for batch in batches for row in batch]
+            for label in ("per_call_connection", "per_batch_connection", "session"):
+                db_manager.DB_NAME = os.path.join(tmp_dir, f"{label}.db")
+                initialize_database()
+                # initialize_database 经由 db_session 把日志模式设为 WAL (写入文件后持久有效)，旧方式改回默认的 DELETE
+                conn = get_db_connection()
+                journal_mode = "WAL" if label == "session" else "DELETE"
+                journal_mode = conn.execute(f"PRAGMA journal_mode = {journal_mode}").fetchone()[0]
+                conn.close()
+                start = time.perf_counter()
+                if label == "per_call_connection":
+                    conn = get_db_connection()
+                    conn.executemany(sql, rows)
+                    conn.commit()
+                    conn.close()
+                elif label == "per_batch_connection":
+                    for batch in batches:
+                        conn = get_db_connection()
+                        conn.executemany(sql, batch)
+                        conn.commit()
+                        conn.close()
+                else:
+                    with db_session() as conn:
+                        with transaction(conn):
+                            stream_insert_documents(batches, checkpoint_every=None, conn=conn)
+                elapsed = time.perf_counter() - start
+                results[label] = n_docs / elapsed
+                print(f"[insert:{label}] N={n_docs}, journal_mode={journal_mode}: {elapsed:.3f}s, "
+                      f"{n_docs / elapsed:,.0f} inserts/sec")
+        finally:
+            db_manager.DB_NAME = original_db_name
+    return results
+
+# ---------------------------------------------------------------------------
+# 完整基准套件: 按规模阶梯逐个阶段单独计时，并测量端到端流程；
+# 结果写成 JSON，可与保存的基线对比，标记变慢的阶段
+
+# 规模阶梯 (V 固定为 config.V_SIZE)
+SIZE_LADDER = {
+    'small': {'N_docs': 1000, 'doc_length': 50, 'K_topics': 5},
+    'medium': {'N_docs': 10000, 'doc_length': 200, 'K_topics': 20},
+    'large': {'N_docs': 100000, 'doc_length': 1000, 'K_topics': 50},
+}
+
+# 阶段及其依赖 (按执行顺序)；未被选中但被依赖的阶段只运行一次、不计时
+STAGES = ['create_phi', 'generate', 'insert', 'fetch', 'train', 'evaluate', 'likelihood', 'end_to_end']
+STAGE_DEPENDS = {
+    'create_phi': [],
+    'generate': ['create_phi'],
+    'insert': ['generate'],
+    'fetch': ['insert'],
+    'train': ['fetch'],
+    'evaluate': ['train'],
+    'likelihood': ['train'],
+    'end_to_end': ['create_phi'],
+}
+# 访问数据库的阶段额外报告 rows/sec
+DB_STAGES = {'insert', 'fetch', 'end_to_end'}
+# 与文档数无关的阶段不报告 docs/sec
+PER_CASE_STAGES = {'create_phi'}
+
+# 对比基线时，中位数用时超过基线的 (1 + 阈值) 倍即视为变慢
+DEFAULT_THRESHOLD = 0.10
+# 基线与当前用时都低于此值 (秒) 的阶段受计时噪声影响太大，不参与判定
+DEFAULT_MIN_SECONDS = 0.005
+
+#运行期间屏蔽各函数自身的 print 输出，避免干扰计时与报告
+@contextmanager
+def _quiet():
+    with redirect_stdout(io.StringIO()):
+        yield
+
+#为一次试验准备一个全新的临时数据库文件
+def _fresh_database(tmp_dir, name):
+    path = os.path.join(tmp_dir, f"{name}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    db_manager.DB_NAME = path
+    initialize_database()
+    return path
+
+def _stage_create_phi(case, state, seed):
+    state['phi'] = create_phi_matrix(case['K_topics'], V_SIZE)
+
+def _stage_generate(case, state, seed):
+    state['theta'], state['dtm'] = generate_count_matrix(state['phi'], ALPHA_PARAM, case['N_docs'],
+                                                         case['doc_length'], seed=seed)
+
+def _prepare_insert(case, state, seed, tmp_dir):
+    # 编码在准备阶段完成，只对写入计时
+    _fresh_database(tmp_dir, 'insert')
+    corpus = {'theta': state['theta'], 'dtm': state['dtm']}
+    state['insert_batches'] = list(iter_corpus_batches(corpus, 1))
+
+def _stage_insert(case, state, seed):
+    with db_session() as conn:
+        with transaction(conn):
+            stream_insert_documents(state['insert_batches'], conn=conn)
+
+def _stage_fetch(case, state, seed):
+    _, state['theta'], state['dtm'] = fetch_document_term_matrix(1, V_SIZE)
+
+def _stage_train(case, state, seed):
+    state['theta_pred'], state['lda_model'] = train_and_predict_lda(state['dtm'], state['dtm'], case['K_topics'],
+                                                                    return_model=True)
+
+def _stage_evaluate(case, state, seed):
+    evaluate_theta(state['theta'], state['theta_pred'], state['lda_model'].components_, state['phi'])
+
+def _stage_likelihood(case, state, seed):
+    evaluate_likelihood(lambda: iter_row_chunks(state['dtm']), state['theta_pred'], state['lda_model'].components_,
+                        state['theta'], state['phi'])
+
+def _prepare_end_to_end(case, state, seed, tmp_dir):
+    _fresh_database(tmp_dir, 'end_to_end')
+
+#端到端: 流式生成入库 -> 读取稀疏矩阵 -> 训练 -> 对齐评估 (与 main_run 的 batch 流程相同)
+def _stage_end_to_end(case, state, seed):
+    phi_matrix = create_phi_matrix(case['K_topics'], V_SIZE)
+    with db_session() as conn:
+        with transaction(conn):
+            batches = iter_document_batches(phi_matrix, build_vocabulary(V_SIZE, case['K_topics']), 1, ALPHA_PARAM, case['N_docs'],
+                                            case['doc_length'], seed=seed)
+            stream_insert_documents(batches, conn=conn)
+        _, true_theta, dtm = fetch_document_term_matrix(1, V_SIZE, conn=conn)
+    theta_pred, lda_model = train_and_predict_lda(dtm, dtm, case['K_topics'], return_model=True)
+    evaluate_theta(true_theta, theta_pred, lda_model.components_, phi_matrix)
+
+# 阶段名 -> (准备函数或 None, 计时函数)
+STAGE_FUNCTIONS = {
+    'create_phi': (None, _stage_create_phi),
+    'generate': (None, _stage_generate),
+    'insert': (_prepare_insert, _stage_insert),
+    'fetch': (None, _stage_fetch),
+    'train': (None, _stage_train),
+    'evaluate': (None, _stage_evaluate),
+    'likelihood': (None, _stage_likelihood),
+    'end_to_end': (_prepare_end_to_end, _stage_end_to_end),
+}
+
+#选中阶段加上其全部依赖，按 STAGES 顺序返回
+def _resolve_stages(selected):
+    needed = set()
+    pending = list(selected)
+    while pending:
+        stage = pending.pop()
+        if stage not in needed:
+            needed.add(stage)
+            pending.extend(STAGE_DEPENDS[stage])
+    return [stage for stage in STAGES if stage in needed]
+
+#单个规模的全部阶段
+def bench_case(case_name, case, stages=STAGES, trials=3, seed=0, tmp_dir=None):
+    """
+    每个选中阶段先做一次预热运行 (同时用 tracemalloc 测量峰值内存)，再计时 trials 次，
+    第 t 次试验使用种子 seed + t；返回结果字典列表。
+    """
+    state = {}
+    results = []
+    for stage in _resolve_stages(stages):
+        prepare, run = STAGE_FUNCTIONS[stage]
+        if stage not in stages:
+            # 仅为后续阶段提供输入
+            with _quiet():
+                if prepare is not None:
+                    prepare(case, state, seed, tmp_dir)
+                run(case, state, seed)
+            continue
+
+        # 预热 + 内存测量
+        with _quiet():
+            if prepare is not None:
+                prepare(case, state, seed, tmp_dir)
+            tracemalloc.start()
+            run(case, state, seed)
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        timings = []
+        for trial in range(trials):
+            with _quiet():
+                if prepare is not None:
+                    prepare(case, state, seed + trial, tmp_dir)
+                start = time.perf_counter()
+                run(case, state, seed + trial)
+                timings.append(time.perf_counter() - start)
+
+        median = statistics.median(timings)
+        n_docs = case['N_docs']
+        result = {
+            'case': case_name,
+            'stage': stage,
+            **case,
+            'V_size': V_SIZE,
+            'trials': trials,
+            'seconds': timings,
+            'best_seconds': min(timings),
+            'median_seconds': median,
+            'docs_per_sec': n_docs / median if stage not in PER_CASE_STAGES and median > 0 else None,
+            'rows_per_sec': n_docs / median if stage in DB_STAGES and median > 0 else None,
+            'peak_traced_mb': peak_bytes / 1024 ** 2,
+            'peak_rss_mb': peak_rss_kb() / 1024 if peak_rss_kb() is not None else None,
+        }
+        results.append(result)
+        throughput = f"{result['docs_per_sec']:,.0f} docs/sec, " if result['docs_per_sec'] else ""
+        print(f"[{case_name}:{stage}] 中位数 {median:.4f}s (最快 {min(timings):.4f}s), "
+              f"{throughput}峰值内存 {result['peak_traced_mb']:.1f} MB")
+    return results
+
+#完整套件: 依次运行各规模，使用临时 SQLite 文件，结束后恢复 DB_NAME
+def run_suite(case_names=tuple(SIZE_LADDER), stages=STAGES, trials=3, seed=0):
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'generator_version': GENERATOR_VERSION,
+        'seed': seed,
+        'results': [],
+    }
+    original_db_name = db_manager.DB_NAME
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            for case_name in case_names:
+                case = SIZE_LADDER[case_name]
+                print(f"--- 规模 {case_name}: {case} ---")
+                report['results'].extend(bench_case(case_name, case, stages, trials, seed, tmp_dir))
+        finally:
+            db_manager.DB_NAME = original_db_name
+    return report
+
+#与基线对比: 按 (规模, 阶段) 匹配，中位数用时比值超过 1 + threshold 的记为变慢
+def compare_reports(report, baseline, threshold=DEFAULT_THRESHOLD, min_seconds=DEFAULT_MIN_SECONDS):
+    baseline_index = {(r['case'], r['stage']): r for r in baseline['results']}
+    regressions = []
+    print(f"{'规模:阶段':<24}{'基线(s)':>10}{'当前(s)':>10}{'比值':>8}  结论")
+    for result in report['results']:
+        base = baseline_index.get((result['case'], result['stage']))
+        label = f"{result['case']}:{result['stage']}"
+        if base is None:
+            print(f"{label:<24}{'-':>10}{result['median_seconds']:>10.4f}{'-':>8}  基线中无此项")
+            continue
+        ratio = result['median_seconds'] / base['median_seconds'] if base['median_seconds'] > 0 else float('inf')
+        if max(result['median_seconds'], base['median_seconds']) < min_seconds:
+            verdict = "用时过短，不判定"
+        elif ratio > 1 + threshold:
+            verdict = f"变慢 {ratio - 1:.0%}"
+            regressions.append({'case': result['case'], 'stage': result['stage'], 'ratio': ratio})
+        elif ratio < 1 - threshold:
+            verdict = f"变快 {1 - ratio:.0%}"
+        else:
+            verdict = "持平"
+        print(f"{label:<24}{base['median_seconds']:>10.4f}{result['median_seconds']:>10.4f}{ratio:>8.2f}  {verdict}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LDA 模拟流程性能基准")
+    parser.add_argument('--sizes', default='small,medium',
+                        help=f"逗号分隔的规模名，可选 {','.join(SIZE_LADDER)} (默认 small,medium)")
+    parser.add_argument('--stages', default=','.join(STAGES), help="逗号分隔的阶段名 (默认全部)")
+    parser.add_argument('--trials', type=int, default=3, help="每个阶段的计时次数")
+    parser.add_argument('--seed', type=int, default=0, help="固定随机种子")
+    parser.add_argument('--output', help="结果 JSON 文件路径")
+    parser.add_argument('--compare', help="基线 JSON 文件路径，对比后有变慢的阶段时以状态码 1 退出")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="判定变慢的相对阈值")
+    parser.add_argument('--min-seconds', type=float, default=DEFAULT_MIN_SECONDS, help="低于此用时的阶段不判定快慢")
+    parser.add_argument('--micro', action='store_true', help="只运行生成引擎与入库方式的对比微基准")
+    args = parser.parse_args(argv)
+
+    if args.micro:
+        bench_generate()
+        bench_insert()
+        return 0
+
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown = [stage for stage in stages if stage not in STAGE_FUNCTIONS]
+    if unknown:
+        parser.error(f"未知阶段: {unknown}")
+    report = run_suite(args.sizes.split(','), stages, args.trials, args.seed)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.threshold, args.min_seconds)
+        if regressions:
+            print(f"[警告] {len(regressions)} 个阶段比基线变慢超过 {args.threshold:.0%}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
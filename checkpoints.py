@@ -0,0 +1,34 @@
+import os
+import numpy as np
+
+from config import CHECKPOINT_DIR
+
+# 训练检查点: LDA 训练结束后把 doc_ids、预测的 theta 与 components_ 保存为 .npz，
+# 运行在之后的阶段中断时，续跑可直接载入而不必重新训练；运行完成或被清理后删除
+
+def _checkpoint_path(run_id, checkpoint_dir):
+    return os.path.join(checkpoint_dir, f"run_{int(run_id)}_training.npz")
+
+#写入训练检查点 (先写临时文件再原子替换，中断时不会留下写了一半的文件)
+def store_training_checkpoint(run_id, doc_ids, theta_pred, components, checkpoint_dir=CHECKPOINT_DIR):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = _checkpoint_path(run_id, checkpoint_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, doc_ids=np.asarray(doc_ids), theta_pred=theta_pred, components=components)
+    os.replace(tmp_path, path)
+    return path
+
+#读取训练检查点: 返回 {'doc_ids', 'theta_pred', 'components'}，不存在时返回 None
+def load_training_checkpoint(run_id, checkpoint_dir=CHECKPOINT_DIR):
+    try:
+        with np.load(_checkpoint_path(run_id, checkpoint_dir)) as archive:
+            return {name: archive[name] for name in ('doc_ids', 'theta_pred', 'components')}
+    except FileNotFoundError:
+        return None
+
+def remove_training_checkpoint(run_id, checkpoint_dir=CHECKPOINT_DIR):
+    try:
+        os.remove(_checkpoint_path(run_id, checkpoint_dir))
+    except FileNotFoundError:
+        pass
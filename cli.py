@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+
+import config
+
+# 命令行入口 (无界面): run / resume / sweep / export / report / cleanup / gui
+# 配置覆盖 (--config 文件、--set 与子命令参数) 先写入 config，再按子命令延迟导入所需模块，
+# 因此其他模块在导入时读到的就是覆盖后的常量；sklearn 与 tkinter 只在需要它们的子命令中加载
+
+# run 子命令参数与 config 常量的对应关系
+RUN_OPTIONS = {
+    'K': 'K_TOPICS',
+    'V': 'V_SIZE',
+    'N': 'N_DOCS',
+    'alpha': 'ALPHA_PARAM',
+    'doc_length': 'DOC_LENGTH',
+    'seed': 'RANDOM_SEED',
+    'shards': 'GEN_SHARDS',
+    'method': 'LDA_LEARNING_METHOD',
+    'test_fraction': 'TEST_FRACTION',
+}
+
+#解析 --set KEY=VALUE: 值按 JSON 解析 (数字、null、列表等)，解析失败时按字符串处理
+def parse_assignment(text):
+    key, sep, value = text.partition('=')
+    if not sep or not key:
+        raise argparse.ArgumentTypeError(f"应为 KEY=VALUE 格式: {text}")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+#汇总配置覆盖: 配置文件 < --set < --db 与子命令参数
+def collect_overrides(args):
+    overrides = {}
+    if args.config:
+        with open(args.config, encoding='utf-8') as f:
+            overrides.update(json.load(f))
+    overrides.update(args.set)
+    if args.db:
+        overrides['DB_NAME'] = args.db
+    if args.command == 'run':
+        for option, name in RUN_OPTIONS.items():
+            value = getattr(args, option)
+            if value is not None:
+                overrides[name] = value
+    return overrides
+
+def cmd_run(args):
+    from db_manager import initialize_database
+    from main_run import run_pipeline
+    initialize_database()
+    try:
+        run_id, avg_similarity = run_pipeline()
+    except RuntimeError as e:
+        print(f"[失败] {e}")
+        return 1
+    print(f"\nrun_id {run_id} 平均余弦相似度: {avg_similarity:.4f}")
+    return 0
+
+def cmd_resume(args):
+    from db_manager import initialize_database
+    from main_run import resume_run
+    initialize_database()
+    try:
+        run_id, avg_similarity = resume_run(args.run_id)
+    except RuntimeError as e:
+        print(f"[失败] {e}")
+        return 1
+    print(f"\nrun_id {run_id} 平均余弦相似度: {avg_similarity:.4f}")
+    return 0
+
+def cmd_sweep(args):
+    from sweep import expand_grid, run_sweep
+    finished = run_sweep(expand_grid(json.loads(args.grid)), replicates=args.replicates, seed=args.seed,
+                         max_workers=args.workers)
+    print(f"共 {len(finished)} 个任务: run_id {[run_id for _, _, run_id in finished]}")
+    return 0
+
+def cmd_export(args):
+    from corpus_io import export_run
+    return 0 if export_run(args.run_id, args.out_dir) is not None else 1
+
+#report 只导入 db_manager 与 metrics (不加载 sklearn / scipy)，供调度器频繁调用
+def cmd_report(args):
+    if not os.path.exists(config.DB_NAME):
+        print(f"[失败] 数据库文件不存在: {config.DB_NAME}")
+        return 1
+    from db_manager import (initialize_database, fetch_run_parameters, fetch_run_summary, fetch_run_metrics,
+                            fetch_recent_runs, compare_runs)
+    initialize_database()
+
+    if args.run_id is None:
+        report = {'runs': fetch_recent_runs(args.limit)}
+        if args.compare:
+            report['comparison'] = compare_runs()
+    else:
+        params = fetch_run_parameters(args.run_id)
+        if params is None:
+            print(f"[失败] run_id {args.run_id} 不存在")
+            return 1
+        report = {'params': params, 'summary': fetch_run_summary(args.run_id),
+                  'metrics': fetch_run_metrics(args.run_id)}
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, default=str))
+    elif args.run_id is None:
+        print_run_list(report['runs'])
+        if args.compare:
+            print_comparison(report['comparison'] or [])
+    else:
+        print_run_report(report)
+    return 0
+
+def print_run_list(runs):
+    print(f"{'run_id':>7}{'K':>4}{'V':>7}{'N':>8}{'alpha':>7}{'状态':>11}{'相似度':>9}{'困惑度':>11}")
+    for run in runs:
+        score = f"{run['final_similarity_score']:.4f}" if run['final_similarity_score'] is not None else "-"
+        perplexity = f"{run['heldout_perplexity']:.2f}" if run['heldout_perplexity'] is not None else "-"
+        print(f"{run['run_id']:>7}{run['K_topics']:>4}{run['V_size']:>7}{run['N_docs']:>8}{run['alpha_param']:>7}"
+              f"{run['status'] or '-':>11}{score:>9}{perplexity:>11}")
+
+def print_comparison(comparison):
+    print("\n--- 按参数分组对比 ---")
+    for entry in comparison:
+        print(f"K={entry['K_topics']}, alpha={entry['alpha_param']}, N={entry['N_docs']}: {entry['n_runs']} 次运行, "
+              f"均值 {entry['mean_score']:.4f} ± {entry['std_score']:.4f} "
+              f"[{entry['min_score']:.4f}, {entry['max_score']:.4f}]")
+
+def print_run_report(report):
+    from metrics import format_metrics_summary
+    params = report['params']
+    print(f"--- run_id {params['run_id']} ({params['status']}) ---")
+    print(f"K={params['K_topics']}, V={params['V_size']}, N={params['N_docs']}, alpha={params['alpha_param']}, "
+          f"文档长度={params['doc_length']}, 种子={params['seed']}, 日期={params['sim_date']}")
+    if params['documents_run_id'] != params['run_id']:
+        print(f"语料复用自 run_id {params['documents_run_id']}")
+    summary = report['summary']
+    if summary is not None:
+        print(f"相似度: 均值 {summary['mean']:.4f}, 标准差 {summary['std']:.4f}, "
+              f"中位数 {summary['quantiles'][0.5]:.4f} (共 {summary['n']} 篇)")
+    if params.get('heldout_perplexity') is not None:
+        print(f"测试集困惑度: {params['heldout_perplexity']:.2f}, 真实模型困惑度: {params['true_perplexity']:.2f}")
+    if report['metrics']:
+        print(format_metrics_summary(report['metrics']))
+
+#cleanup 同样不加载 sklearn / scipy
+def cmd_cleanup(args):
+    if not os.path.exists(config.DB_NAME):
+        print(f"[失败] 数据库文件不存在: {config.DB_NAME}")
+        return 1
+    from db_manager import initialize_database, cleanup_abandoned_runs, vacuum_database
+    from checkpoints import remove_training_checkpoint
+    initialize_database()
+    statuses = args.status or ['aborted', 'failed']
+    result = cleanup_abandoned_runs(statuses, batch_size=args.batch_size or config.CLEANUP_BATCH_SIZE,
+                                    dry_run=args.dry_run)
+    if result is None:
+        return 1
+    if not args.dry_run:
+        for run_id in result['runs']:
+            remove_training_checkpoint(run_id)
+    verb = "将删除" if args.dry_run else "已删除"
+    print(f"{verb} {len(result['runs'])} 个运行 (状态: {', '.join(statuses)}，含参数行已不存在的孤立数据): "
+          f"{result['runs']}")
+    if result['kept_corpus_runs']:
+        print(f"语料仍被其他运行复用，保留其文档: {result['kept_corpus_runs']}")
+    print(", ".join(f"{table} {n} 行" for table, n in result['rows'].items()))
+    if args.vacuum and not args.dry_run:
+        vacuum_database()
+        print("数据库文件已整理 (VACUUM)。")
+    return 0
+
+def cmd_gui(args):
+    from GUI import SimpleLDAApp
+    SimpleLDAApp().mainloop()
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="LDA 统计模拟命令行")
+    parser.add_argument('--config', default=None, help="JSON 配置文件，键为 config 中的常量名 (如 {\"K_TOPICS\": 10})")
+    parser.add_argument('--set', type=parse_assignment, action='append', default=[], metavar='KEY=VALUE',
+                        help="覆盖单个配置项，可重复，如 --set N_DOCS=5000")
+    parser.add_argument('--db', default=None, help="数据库文件 (覆盖 DB_NAME)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="运行一次完整模拟")
+    run_parser.add_argument('--K', type=int, help="主题数")
+    run_parser.add_argument('--V', type=int, help="词汇表大小")
+    run_parser.add_argument('--N', type=int, help="文档数")
+    run_parser.add_argument('--alpha', type=float, help="Dirichlet 超参数")
+    run_parser.add_argument('--doc-length', type=int, help="文档平均长度")
+    run_parser.add_argument('--seed', type=int, help="随机种子")
+    run_parser.add_argument('--shards', type=int, help="并行生成的分片数")
+    run_parser.add_argument('--method', choices=('batch', 'online'), help="LDA 训练方式")
+    run_parser.add_argument('--test-fraction', type=float, help="测试集比例")
+    run_parser.set_defaults(func=cmd_run)
+
+    resume_parser = subparsers.add_parser('resume', help="从最后完成的阶段续跑一次中断的运行")
+    resume_parser.add_argument('run_id', type=int)
+    resume_parser.set_defaults(func=cmd_resume)
+
+    sweep_parser = subparsers.add_parser('sweep', help="参数扫描")
+    sweep_parser.add_argument('--grid', default='{}', help="JSON 网格，如 '{\"K_topics\": [5, 10]}'")
+    sweep_parser.add_argument('--replicates', type=int, default=1)
+    sweep_parser.add_argument('--seed', type=int, default=None)
+    sweep_parser.add_argument('--workers', type=int, default=None)
+    sweep_parser.set_defaults(func=cmd_sweep)
+
+    export_parser = subparsers.add_parser('export', help="导出一次运行的语料 (.npy)")
+    export_parser.add_argument('run_id', type=int)
+    export_parser.add_argument('out_dir')
+    export_parser.set_defaults(func=cmd_export)
+
+    report_parser = subparsers.add_parser('report', help="查看运行结果 (不指定 run_id 时列出最近的运行)")
+    report_parser.add_argument('run_id', type=int, nargs='?')
+    report_parser.add_argument('--limit', type=int, default=20, help="列出的运行数")
+    report_parser.add_argument('--compare', action='store_true', help="同时按参数分组对比")
+    report_parser.add_argument('--json', action='store_true', help="以 JSON 输出")
+    report_parser.set_defaults(func=cmd_report)
+
+    cleanup_parser = subparsers.add_parser('cleanup', help="分批删除中断 / 失败运行留下的数据")
+    cleanup_parser.add_argument('--status', action='append', choices=('aborted', 'failed', 'running'),
+                                help="要清理的运行状态，可重复 (默认 aborted 与 failed；running 只应在确认进程已退出后使用)")
+    cleanup_parser.add_argument('--batch-size', type=int, default=None,
+                                help="每批删除的行数 (默认 CLEANUP_BATCH_SIZE)")
+    cleanup_parser.add_argument('--dry-run', action='store_true', help="只统计，不删除")
+    cleanup_parser.add_argument('--vacuum', action='store_true', help="删除后整理数据库文件，回收空间")
+    cleanup_parser.set_defaults(func=cmd_cleanup)
+
+    gui_parser = subparsers.add_parser('gui', help="启动图形界面")
+    gui_parser.set_defaults(func=cmd_gui)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        config.apply_overrides(collect_overrides(args))
+    except KeyError as e:
+        print(f"[失败] {e.args[0]}")
+        return 2
+    return args.func(args)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
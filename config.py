@@ -1,4 +1,5 @@
 import datetime
+import functools
 
 DB_NAME = 'lda_simulation.db' 
 
@@ -7,16 +8,85 @@ K_TOPICS = 5        # 主题数 K
 V_SIZE = 1000       # 词汇表大小 V
 N_DOCS = 3000       # 模拟文档总数 N
 ALPHA_PARAM = 0.5   # Dirichlet 分布的超参数
-SIM_DATE = datetime.datetime.now() # 模拟运行时间
 DOC_LENGTH = 200    # 文档平均长度
+RANDOM_SEED = None  # 文档生成随机种子 (None 表示每次运行随机)
+GEN_BLOCK_SIZE = 1000 # 批量生成时每块的文档数
+GEN_SHARDS = 1 # 并行生成的分片数 (1 为单进程生成)；相同种子与分片数生成的语料逐位相同
+GEN_WORKERS = None # 并行生成的进程数 (None 为 CPU 核数)，不影响生成结果
+INSERT_CHECKPOINT_BATCHES = 10 # 流式入库时每写入多少个批次提交一次
+THETA_DTYPE = 'float64' # theta 向量二进制存储精度: 'float64' / 'float32'
+SQLITE_CACHE_SIZE_KB = 65536 # SQLite 页缓存大小 (KB)
+SQLITE_MMAP_SIZE = 268435456 # SQLite 内存映射大小 (字节)
+READ_ARRAYSIZE = 1000 # 流式读取时游标每次取回的行数 (cursor.arraysize)
+STORAGE_MODE = 'sparse' # 文档存储方式: 'sparse' 稀疏词频 BLOB / 'text' 空格分隔文本
+CORPUS_CACHE_DIR = 'corpus_cache' # 语料缓存目录 (.npz)
+CORPUS_CACHE_MAX_BYTES = 2 * 1024 ** 3 # 语料缓存容量上限 (字节)，超出后按 LRU 淘汰
+TRACE_PYTHON_MEMORY = False # 阶段计时时是否用 tracemalloc 记录 Python 内存峰值 (有额外开销)
+CHECKPOINT_DIR = 'checkpoints' # 训练检查点目录 (.npz)，运行完成后删除
+CLEANUP_BATCH_SIZE = 5000 # 清理中断运行时每批删除的行数
 
-#词汇表 (Vocabulary)
-vocabulary = []
-num_of_words_per_topic = 200
+#LDA 训练参数
+TEST_FRACTION = 0.2 # 留作测试集的文档比例: 只用训练集拟合 LDA，困惑度在测试集上按文档补全计算 (0 表示全部用于训练)
+COMPLETION_MAX_ITER = 100 # 文档补全: 在测试文档的一半词频上推断 theta 的最大迭代次数
+EVAL_CHUNK_SIZE = 2048 # 似然评估时每块的文档数
+BOOTSTRAP_RESAMPLES = 10000 # 自助法 (bootstrap) 重抽样次数 B
+BOOTSTRAP_CHUNK_CELLS = 20000000 # 自助法每块索引矩阵的元素数上限 (块行数 x N)，限制内存
+CONFIDENCE_LEVEL = 0.95 # 置信区间的置信水平
+LDA_LEARNING_METHOD = 'batch' # 'batch' 整体训练 / 'online' 从数据库按小批量流式训练
+LDA_MAX_ITER = 10   # batch 模式训练遍历语料的最大次数
+LDA_N_JOBS = None   # 并行 E 步的进程数 (None 为单进程, -1 为全部 CPU 核)
+ONLINE_BATCH_SIZE = 512 # online 模式每个小批量的文档数
+ONLINE_MAX_EPOCHS = 10  # online 模式最多遍历语料的次数
+LEARNING_DECAY = 0.7    # online 学习率衰减 kappa
+LEARNING_OFFSET = 10.0  # online 学习率偏移 tau0
+ONLINE_TOL = 1e-3       # 相邻 epoch 主题-词分布的相对变化小于该值时停止
+
+#词汇表 (Vocabulary): 前 5 个主题沿用原有的主题名，每个主题 V // K 个词；
+# 按需构建 (见 build_vocabulary 与模块末尾的 __getattr__)，不在导入时生成
 topics = ['Movies_A', 'Sports_B', 'Finance_C', 'Life_D', 'Literature_E']
 
-# 生成1000个词
-for topic in topics:
-    for i in range(1, num_of_words_per_topic + 1):
-        word = topic + str(i).zfill(3) 
-        vocabulary.append(word)
\ No newline at end of file
+#为任意 V / K 构建词汇表: 第 k 个主题的词占据 [k * V // K, (k + 1) * V // K)，与 create_phi_matrix 的主题词区间一致
+@functools.lru_cache(maxsize=8)
+def build_vocabulary(V=None, K=None):
+    V = V_SIZE if V is None else V
+    K = K_TOPICS if K is None else K
+    num_of_words_per_topic = V // K
+    width = max(3, len(str(num_of_words_per_topic)))
+    words = []
+    for k in range(K):
+        topic = topics[k] if k < len(topics) else f"Topic{k + 1}_"
+        for i in range(1, num_of_words_per_topic + 1):
+            words.append(topic + str(i).zfill(width))
+    # V 不能被 K 整除时，剩余的词不属于任何主题
+    for i in range(1, V - len(words) + 1):
+        words.append("Extra_" + str(i).zfill(width))
+    return words
+
+#模拟运行时间: 记录参数时调用，取当前时间 (而不是导入 config 的时间)
+def current_sim_date():
+    return datetime.datetime.now()
+
+# 已应用的运行时覆盖 (常量名 -> 值)，传给进程池的 initializer，使 spawn / forkserver 启动的工作进程看到相同的配置
+_overrides = {}
+
+#运行时配置: 用字典覆盖本模块的常量 (键为常量名，不区分大小写)，需在导入其他模块之前调用
+def apply_overrides(overrides):
+    for key, value in overrides.items():
+        name = key.upper()
+        if name not in globals():
+            raise KeyError(f"未知的配置项: {key}")
+        globals()[name] = value
+        _overrides[name] = value
+    build_vocabulary.cache_clear()
+
+#当前进程已应用的全部覆盖，用法: ProcessPoolExecutor(initializer=apply_overrides, initargs=(current_overrides(),))
+def current_overrides():
+    return dict(_overrides)
+
+#兼容旧的模块属性: config.vocabulary / config.SIM_DATE 在访问时才计算
+def __getattr__(name):
+    if name == 'vocabulary':
+        return build_vocabulary(V_SIZE, K_TOPICS)
+    if name == 'SIM_DATE':
+        return current_sim_date()
+    raise AttributeError(f"module 'config' has no attribute '{name}'")
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from config import CORPUS_CACHE_DIR, CORPUS_CACHE_MAX_BYTES, GEN_BLOCK_SIZE, STORAGE_MODE
+from db_manager import encode_sparse_rows, encode_theta_rows
+from stat_sim import GENERATOR_VERSION
+
+# 语料缓存: 以 (参数 + 种子 + 生成器版本) 的哈希为键，把 phi / theta / 词频矩阵保存为 .npz 文件，
+# 超过容量上限时按最近使用时间 (文件 mtime) 淘汰
+
+#缓存键: 没有确定的种子时语料不可复现，返回 None (不缓存)
+def corpus_key(K_topics, V_size, alpha_param, n_docs, doc_length, seed, seed_stream=None, block_size=GEN_BLOCK_SIZE,
+               n_shards=1):
+    if seed is None:
+        return None
+    payload = {
+        'K_topics': int(K_topics),
+        'V_size': int(V_size),
+        'alpha_param': float(alpha_param),
+        'n_docs': int(n_docs),
+        'doc_length': int(doc_length),
+        'seed': int(seed),
+        'seed_stream': None if seed_stream is None else int(seed_stream),
+        'block_size': int(block_size), # 块大小决定随机数的抽取顺序
+        'n_shards': int(n_shards), # 分片数决定每个分片的随机数流
+        'generator_version': GENERATOR_VERSION,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+#每次运行的命中 / 未命中计数
+def new_cache_stats():
+    return {'hits': 0, 'misses': 0}
+
+def format_cache_stats(stats):
+    return f"语料缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次"
+
+def _cache_path(key, cache_dir):
+    return os.path.join(cache_dir, f"{key}.npz")
+
+#读取缓存: 命中时返回 {'phi', 'theta', 'dtm'} 并刷新其最近使用时间，否则返回 None
+def load_corpus(key, cache_dir=CORPUS_CACHE_DIR, stats=None):
+    corpus = None
+    if key is not None:
+        path = _cache_path(key, cache_dir)
+        try:
+            with np.load(path) as archive:
+                dtm = csr_matrix((archive['data'], archive['indices'], archive['indptr']), shape=tuple(archive['shape']))
+                corpus = {'phi': archive['phi'], 'theta': archive['theta'], 'dtm': dtm}
+            os.utime(path) # LRU: 以 mtime 记录最近使用时间
+        except FileNotFoundError:
+            # 不存在，或刚被其他进程淘汰
+            corpus = None
+
+    if stats is not None:
+        stats['hits' if corpus is not None else 'misses'] += 1
+    return corpus
+
+#把缓存的语料转换为入库数据批次，格式与 stat_sim.iter_document_batches 相同
+def iter_corpus_batches(corpus, run_id, vocabulary=None, storage_mode=STORAGE_MODE, batch_size=GEN_BLOCK_SIZE, progress=None):
+    theta, dtm = corpus['theta'], corpus['dtm']
+    n_docs = dtm.shape[0]
+    for start in range(0, n_docs, batch_size):
+        stop = min(start + batch_size, n_docs)
+        theta_blobs = encode_theta_rows(theta[start:stop])
+        block = dtm[start:stop]
+        if storage_mode == 'sparse':
+            rows = [(run_id, None, theta_blob, count_blob)
+                    for theta_blob, count_blob in zip(theta_blobs, encode_sparse_rows(block))]
+        else:
+            rows = []
+            for theta_blob, i in zip(theta_blobs, range(block.shape[0])):
+                row = block.getrow(i)
+                words = np.repeat(row.indices, row.data.astype(np.int64))
+                rows.append((run_id, " ".join([vocabulary[w] for w in words.tolist()]), theta_blob, None))
+        if progress is not None:
+            progress(stop, n_docs)
+        yield rows
+
+#写入缓存，随后按 LRU 淘汰超出容量的旧文件
+def store_corpus(key, phi_matrix, theta, dtm, cache_dir=CORPUS_CACHE_DIR, max_bytes=CORPUS_CACHE_MAX_BYTES):
+    if key is None:
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(key, cache_dir)
+    # 先写临时文件再原子替换，避免并发读到写了一半的文件
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, phi=phi_matrix, theta=theta, data=dtm.data, indices=dtm.indices,
+                 indptr=dtm.indptr, shape=np.asarray(dtm.shape))
+    os.replace(tmp_path, path)
+    evict_lru(cache_dir, max_bytes)
+    return path
+
+#淘汰最久未使用的缓存文件，直到总大小不超过 max_bytes
+def evict_lru(cache_dir=CORPUS_CACHE_DIR, max_bytes=CORPUS_CACHE_MAX_BYTES):
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npz'):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, name in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass # 并行扫描时可能已被其他进程删除
+        total -= size
+        evicted.append(name)
+    return evicted
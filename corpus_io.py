@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from config import build_vocabulary
+from db_manager import fetch_run_parameters, fetch_document_term_matrix, fetch_theta_matrix
+from stat_sim import create_phi_matrix, train_and_predict_lda, GENERATOR_VERSION
+from evaluation import evaluate_theta
+
+# 语料导出 / 导入: 把一次运行的文档-词频矩阵 (CSR 三个数组)、真实与预测 theta、phi 写成 .npy 文件，
+# 读取时用 mmap_mode='r' 内存映射，直接组装成 csr_matrix 交给 LDA，不经过 SQLite 也不复制数据
+
+EXPORT_FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+# 清单中记录的运行参数 (sim_parameters 的列)
+MANIFEST_PARAMS = ('K_topics', 'V_size', 'N_docs', 'alpha_param', 'doc_length', 'seed', 'seed_stream',
+                   'sim_date', 'final_similarity_score', 'status')
+
+#导出一次运行
+def export_run(run_id, out_dir, conn=None):
+    """
+    在 out_dir 下写出 data / indices / indptr / doc_ids / theta_true / theta_pred / phi 的 .npy 文件与 manifest.json。
+    data 存为 float64：LDA 内部按 float64 计算，整数词频会在训练时被复制转换，预先转换后可零拷贝使用。
+    返回清单字典；run 不存在或没有文档时返回 None。
+    """
+    params = fetch_run_parameters(run_id, conn=conn)
+    if params is None:
+        print(f"[失败] run_id {run_id} 不存在。")
+        return None
+    # 文本模式入库的文档需要按词汇表计数
+    vocabulary = build_vocabulary(params['V_size'], params['K_topics'])
+    fetched = fetch_document_term_matrix(params['documents_run_id'], params['V_size'], vocabulary, conn=conn)
+    if fetched is None or not fetched[0]:
+        print(f"[失败] run_id {run_id} 没有可导出的文档。")
+        return None
+    doc_ids, theta_true, dtm = fetched
+    fetched_pred = fetch_theta_matrix(run_id, 'pred', conn=conn)
+    if fetched_pred is None:
+        print(f"[失败] run_id {run_id} 的预测 theta 读取失败。")
+        return None
+    _, theta_pred = fetched_pred
+
+    os.makedirs(out_dir, exist_ok=True)
+    # indices 与 indptr 使用同一种整数类型，否则 scipy 构建矩阵时会统一转换 (产生复制)
+    index_dtype = np.int32 if dtm.nnz < np.iinfo(np.int32).max else np.int64
+    arrays = {
+        'data': dtm.data.astype(np.float64),
+        'indices': dtm.indices.astype(index_dtype),
+        'indptr': dtm.indptr.astype(index_dtype),
+        'doc_ids': np.asarray(doc_ids, dtype=np.int64),
+        'theta_true': theta_true,
+        'phi': create_phi_matrix(params['K_topics'], params['V_size']), # phi 由参数确定，直接重建
+    }
+    if len(theta_pred) == len(doc_ids):
+        arrays['theta_pred'] = theta_pred
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), array)
+
+    manifest = {
+        'format_version': EXPORT_FORMAT_VERSION,
+        'generator_version': GENERATOR_VERSION,
+        'run_id': run_id,
+        'documents_run_id': params['documents_run_id'],
+        'params': {key: params.get(key) for key in MANIFEST_PARAMS},
+        'shape': list(dtm.shape),
+        'nnz': int(dtm.nnz),
+        'files': sorted(f"{name}.npy" for name in arrays),
+    }
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"[成功] run_id {run_id} 已导出到 {out_dir} ({dtm.shape[0]} 篇文档, {dtm.nnz} 个非零元素)。")
+    return manifest
+
+#读取导出的语料
+def load_export(export_dir, mmap=True):
+    """
+    返回 {'manifest', 'dtm', 'doc_ids', 'theta_true', 'theta_pred', 'phi'}，没有预测结果时 theta_pred 为 None。
+    mmap=True 时所有数组都以只读内存映射打开，dtm 直接引用映射的数组，打开耗时与语料大小基本无关。
+    """
+    with open(os.path.join(export_dir, MANIFEST_NAME), encoding='utf-8') as f:
+        manifest = json.load(f)
+    mmap_mode = 'r' if mmap else None
+
+    def load(name):
+        path = os.path.join(export_dir, f"{name}.npy")
+        return np.load(path, mmap_mode=mmap_mode) if os.path.exists(path) else None
+
+    dtm = csr_matrix((load('data'), load('indices'), load('indptr')), shape=tuple(manifest['shape']), copy=False)
+    return {
+        'manifest': manifest,
+        'dtm': dtm,
+        'doc_ids': load('doc_ids'),
+        'theta_true': load('theta_true'),
+        'theta_pred': load('theta_pred'),
+        'phi': load('phi'),
+    }
+
+#基于导出文件重新训练与评估 (不访问数据库)
+def analyse_export(export_dir, K_topics=None):
+    corpus = load_export(export_dir)
+    K_topics = K_topics or corpus['manifest']['params']['K_topics']
+    theta_pred, lda_model = train_and_predict_lda(corpus['dtm'], corpus['dtm'], K_topics, return_model=True)
+    return evaluate_theta(corpus['theta_true'], theta_pred, lda_model.components_, corpus['phi'])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="运行语料的 .npy 导出与导入")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help="导出一次运行")
+    export_parser.add_argument('run_id', type=int)
+    export_parser.add_argument('out_dir')
+    analyse_parser = subparsers.add_parser('analyse', help="以内存映射方式读取导出的语料并重新训练评估")
+    analyse_parser.add_argument('export_dir')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        return 0 if export_run(args.run_id, args.out_dir) is not None else 1
+    evaluation = analyse_export(args.export_dir)
+    print(f"平均余弦相似度: {evaluation['mean']:.4f}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,8 +1,20 @@
 import sqlite3
 import json
 import os
+from contextlib import contextmanager
+import numpy as np
 # 从 config 文件导入 DB_NAME
-from config import DB_NAME
+from config import DB_NAME, THETA_DTYPE, INSERT_CHECKPOINT_BATCHES, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE, READ_ARRAYSIZE, CLEANUP_BATCH_SIZE
+
+# 稀疏词频 BLOB 的存储类型 (小端 int32)
+SPARSE_DTYPE = np.dtype('<i4')
+
+# theta 向量二进制编码: 4 字节头 (魔数 'TH' + 版本号 + 类型码) + 小端浮点数组
+# 不带此头的文本值按旧版 JSON 格式解析
+THETA_MAGIC = b'TH'
+THETA_CODEC_VERSION = 1
+THETA_TYPE_CODES = {np.dtype('<f8'): b'd', np.dtype('<f4'): b'f'}
+THETA_CODE_TYPES = {code: dtype for dtype, code in THETA_TYPE_CODES.items()}
 
 #数据库连接函数
 def get_db_connection():
@@ -15,156 +27,948 @@ def get_db_connection():
         print(f"数据库连接失败: {e}")
         return None
 
-def initialize_database():
+#连接调优: WAL 日志 + NORMAL 同步 + 更大的页缓存、内存临时表和 mmap
+def configure_connection(conn):
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.execute(f"PRAGMA cache_size = -{int(SQLITE_CACHE_SIZE_KB)}") # 负数表示以 KB 为单位
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    cursor.execute(f"PRAGMA mmap_size = {int(SQLITE_MMAP_SIZE)}")
+    return conn
+
+#会话: 整个运行期间复用同一个已调优的连接
+@contextmanager
+def db_session():
+    """
+    用法:
+        with db_session() as conn:
+            with transaction(conn):
+                run_id = record_simulation_parameters(params, conn=conn)
+    退出时提交未提交的修改 (出现异常则回滚) 并关闭连接。
+    """
     conn = get_db_connection()
-    if conn is None: return #若conn对象为空值，直接返回。
-    
+    if conn is None:
+        raise sqlite3.OperationalError(f"无法连接数据库 {DB_NAME}")
+    configure_connection(conn)
     try:
-        cursor = conn.cursor()
-        
-        # 1. 创建 sim_parameters 表，多行字符串
-        cursor.execute(''' 
-            CREATE TABLE IF NOT EXISTS sim_parameters (
-                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                K_topics INTEGER,
-                V_size INTEGER,
-                N_docs INTEGER,
-                alpha_param REAL,
-                sim_date TEXT,
-                final_similarity_score REAL
-            )
-        ''')
-        
-        # 2. 创建 documents_data 表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS documents_data (
-                doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                run_id INTEGER,
-                simulated_text TEXT,
-                true_theta_vector TEXT,
-                FOREIGN KEY(run_id) REFERENCES sim_parameters(run_id)
-            )
-        ''')
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+#显式事务: 块内的多次写入一起提交，出错时整体回滚
+@contextmanager
+def transaction(conn):
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+#内部工具: 传入 conn 时沿用调用方的会话 (由调用方提交)，否则为本次调用临时开一个会话
+@contextmanager
+def _use_connection(conn=None):
+    if conn is not None:
+        yield conn
+    else:
+        with db_session() as own_conn:
+            yield own_conn
+
+def initialize_database(conn=None):
+    try:
+        with _use_connection(conn) as conn:
+            cursor = conn.cursor()
         
-        # 3. 创建 analysis_results 表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS analysis_results (
-                result_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                doc_id INTEGER,
-                run_id INTEGER,
-                predicted_theta_vector TEXT,
-                cosine_similarity REAL,
-                FOREIGN KEY(run_id) REFERENCES sim_parameters(run_id)
-            )
-        ''')
+            # 1. 创建 sim_parameters 表，多行字符串
+            cursor.execute(''' 
+                CREATE TABLE IF NOT EXISTS sim_parameters (
+                    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    K_topics INTEGER,
+                    V_size INTEGER,
+                    N_docs INTEGER,
+                    alpha_param REAL,
+                    sim_date TEXT,
+                    final_similarity_score REAL
+                )
+            ''')
         
-        conn.commit()
+            # 2. 创建 documents_data 表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS documents_data (
+                    doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    run_id INTEGER,
+                    simulated_text TEXT,
+                    true_theta_vector TEXT,
+                    word_counts BLOB,
+                    FOREIGN KEY(run_id) REFERENCES sim_parameters(run_id)
+                )
+            ''')
+
+            # 3. 创建 analysis_results 表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS analysis_results (
+                    result_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    doc_id INTEGER,
+                    run_id INTEGER,
+                    predicted_theta_vector TEXT,
+                    cosine_similarity REAL,
+                    FOREIGN KEY(run_id) REFERENCES sim_parameters(run_id)
+                )
+            ''')
+
+            # 4. 依次执行尚未应用的结构迁移 (补充列、索引等)
+            _apply_migrations(cursor)
+
+            conn.commit()
     except sqlite3.Error as e:
         print(f"初始化数据库表失败: {e}")
-    finally:
-        conn.close()
 
-#记录参数函数
-def record_simulation_parameters(params):
-    conn = get_db_connection()
-    if conn is None: return None
+#为已存在的表补充新列 (SQLite 不支持 ADD COLUMN IF NOT EXISTS)
+def _ensure_column(cursor, table, column, decl):
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    if column not in existing:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+#结构迁移: 每个迁移函数只执行一次，已应用的版本号记录在 PRAGMA user_version 中
+def _migrate_add_word_counts(cursor):
+    # 旧数据库升级: 补充稀疏词频列
+    _ensure_column(cursor, 'documents_data', 'word_counts', 'BLOB')
+
+def _migrate_add_run_indexes(cursor):
+    # 按 run_id 查询 / 按 doc_id 排序时走索引，避免多次运行后的全表扫描；
+    # (run_id, cosine_similarity) 为覆盖索引，分位数与直方图查询无需回表
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_run_doc ON documents_data(run_id, doc_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_results_run_doc ON analysis_results(run_id, doc_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_results_run_similarity ON analysis_results(run_id, cosine_similarity)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_params_config ON sim_parameters(K_topics, alpha_param, N_docs)")
+
+def _migrate_add_run_seed_columns(cursor):
+    # 记录文档长度与随机种子，使任意一次运行都可以按参数精确复现 / 断点续跑时识别已完成的配置
+    _ensure_column(cursor, 'sim_parameters', 'doc_length', 'INTEGER')
+    _ensure_column(cursor, 'sim_parameters', 'seed', 'INTEGER')
+    _ensure_column(cursor, 'sim_parameters', 'seed_stream', 'INTEGER')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_params_seed ON sim_parameters(seed, seed_stream)")
+
+def _migrate_add_run_status(cursor):
+    # 运行状态: running / completed / aborted (用户取消) / failed；旧数据中有最终分数的视为 completed
+    _ensure_column(cursor, 'sim_parameters', 'status', 'TEXT')
+    cursor.execute("UPDATE sim_parameters SET status = 'completed' WHERE status IS NULL AND final_similarity_score IS NOT NULL")
+
+def _migrate_add_corpus_columns(cursor):
+    # 语料键 (参数 + 种子 + 生成器版本的哈希) 与语料来源: corpus_run_id 非空时，
+    # 本次运行的文档直接复用该 run 已入库的 documents_data 行
+    _ensure_column(cursor, 'sim_parameters', 'corpus_key', 'TEXT')
+    _ensure_column(cursor, 'sim_parameters', 'corpus_run_id', 'INTEGER')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_params_corpus_key ON sim_parameters(corpus_key)")
+
+def _migrate_add_run_metrics(cursor):
+    # 各阶段的用时、内存与行数，按 run_id 查询，可用 SQL 跨运行比较
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS run_metrics (
+            metric_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id INTEGER,
+            stage_order INTEGER,
+            stage TEXT,
+            wall_seconds REAL,
+            cpu_seconds REAL,
+            peak_rss_kb INTEGER,
+            peak_traced_kb INTEGER,
+            n_rows INTEGER,
+            FOREIGN KEY(run_id) REFERENCES sim_parameters(run_id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_metrics_run_stage ON run_metrics(run_id, stage)")
+
+def _migrate_add_gen_shards(cursor):
+    # 并行生成的分片数: 同一种子在不同分片数下生成的语料不同，复现时需要一并记录；旧数据均为单进程生成
+    _ensure_column(cursor, 'sim_parameters', 'gen_shards', 'INTEGER')
+    cursor.execute("UPDATE sim_parameters SET gen_shards = 1 WHERE gen_shards IS NULL")
+
+def _migrate_add_likelihood_columns(cursor):
+    # 训练 / 测试划分与似然评估: 逐文档结果存入 analysis_results，测试集汇总存入 sim_parameters。
+    # 测试文档的 log_likelihood / true_log_likelihood / token_count 为文档补全估计 (只含留出的一半词频，
+    # 见 evaluation.evaluate_likelihood)，训练文档为样本内估计
+    _ensure_column(cursor, 'analysis_results', 'split', 'TEXT')
+    _ensure_column(cursor, 'analysis_results', 'log_likelihood', 'REAL')
+    _ensure_column(cursor, 'analysis_results', 'true_log_likelihood', 'REAL')
+    _ensure_column(cursor, 'analysis_results', 'token_count', 'INTEGER')
+    for column in ('test_fraction', 'heldout_log_likelihood', 'heldout_perplexity', 'true_log_likelihood', 'true_perplexity'):
+        _ensure_column(cursor, 'sim_parameters', column, 'REAL')
+
+def _migrate_add_experiments(cursor):
+    # 重复实验: 同一配置的多个重复运行通过 sim_parameters.experiment_id 关联到一个实验
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS experiments (
+            experiment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            created TEXT,
+            config_json TEXT,
+            replicates INTEGER,
+            seed INTEGER,
+            n_bootstrap INTEGER,
+            confidence REAL,
+            results_json TEXT
+        )
+    ''')
+    _ensure_column(cursor, 'sim_parameters', 'experiment_id', 'INTEGER')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_params_experiment ON sim_parameters(experiment_id)")
+
+def _migrate_add_run_stages(cursor):
+    # 各运行已完成的阶段 (RUN_STAGES)，供中断后续跑；旧数据按已有的行补记
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS run_stages (
+            run_id INTEGER,
+            stage TEXT,
+            completed_at TEXT,
+            PRIMARY KEY(run_id, stage),
+            FOREIGN KEY(run_id) REFERENCES sim_parameters(run_id)
+        )
+    ''')
+    backfill = {
+        'params': "1",
+        'documents': ("corpus_run_id IS NOT NULL OR status = 'completed' OR "
+                      "(SELECT COUNT(*) FROM documents_data d WHERE d.run_id = p.run_id) = N_docs"),
+        'training': "EXISTS (SELECT 1 FROM analysis_results a WHERE a.run_id = p.run_id)",
+        'results': "EXISTS (SELECT 1 FROM analysis_results a WHERE a.run_id = p.run_id)",
+        'score': "final_similarity_score IS NOT NULL",
+    }
+    for stage, condition in backfill.items():
+        cursor.execute(f"INSERT OR IGNORE INTO run_stages (run_id, stage) "
+                       f"SELECT run_id, ? FROM sim_parameters p WHERE {condition}", (stage,))
+
+def _migrate_add_rss_columns(cursor):
+    # peak_rss_kb 是进程启动以来的累计峰值；补充阶段结束时的常驻内存与阶段内的变化量，便于按阶段定位内存回退
+    _ensure_column(cursor, 'run_metrics', 'rss_kb', 'INTEGER')
+    _ensure_column(cursor, 'run_metrics', 'rss_delta_kb', 'INTEGER')
+
+def _migrate_add_experiment_runs(cursor):
+    # 实验与运行的多对多关联: 同一种子重跑实验时，已完成的运行会同时属于新旧两个实验，
+    # 不能只靠 sim_parameters.experiment_id (保留为运行最初所属的实验)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS experiment_runs (
+            experiment_id INTEGER,
+            run_id INTEGER,
+            PRIMARY KEY(experiment_id, run_id),
+            FOREIGN KEY(experiment_id) REFERENCES experiments(experiment_id),
+            FOREIGN KEY(run_id) REFERENCES sim_parameters(run_id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_experiment_runs_run ON experiment_runs(run_id)")
+    cursor.execute("INSERT OR IGNORE INTO experiment_runs (experiment_id, run_id) "
+                   "SELECT experiment_id, run_id FROM sim_parameters WHERE experiment_id IS NOT NULL")
+
+SCHEMA_MIGRATIONS = [
+    _migrate_add_word_counts,
+    _migrate_add_run_indexes,
+    _migrate_add_run_seed_columns,
+    _migrate_add_run_status,
+    _migrate_add_corpus_columns,
+    _migrate_add_run_metrics,
+    _migrate_add_gen_shards,
+    _migrate_add_likelihood_columns,
+    _migrate_add_experiments,
+    _migrate_add_run_stages,
+    _migrate_add_rss_columns,
+    _migrate_add_experiment_runs,
+]
+
+def _apply_migrations(cursor):
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for new_version, migration in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        migration(cursor)
+        cursor.execute(f"PRAGMA user_version = {new_version}")
+
+#稀疏词频编码: 一篇文档的词频向量 -> (词索引, 词频) 对的二进制 BLOB
+def encode_sparse_counts(counts):
+    counts = np.asarray(counts)
+    word_ids = np.flatnonzero(counts)
+    pairs = np.stack([word_ids, counts[word_ids]]).astype(SPARSE_DTYPE)
+    return pairs.tobytes()
+
+#稀疏词频批量编码: CSR 文档-词频矩阵 -> 每行一个 BLOB
+def encode_sparse_rows(dtm):
+    indptr, indices, data = dtm.indptr, dtm.indices, dtm.data
+    return [np.stack([indices[start:end], data[start:end]]).astype(SPARSE_DTYPE).tobytes()
+            for start, end in zip(indptr[:-1], indptr[1:])]
 
+#稀疏词频解码: BLOB -> (词索引数组, 词频数组)
+def decode_sparse_counts(blob):
+    pairs = np.frombuffer(blob, dtype=SPARSE_DTYPE).reshape(2, -1)
+    return pairs[0], pairs[1]
+
+#theta 编码: 向量 -> 带版本头的二进制 BLOB
+def _theta_header(dtype):
+    return THETA_MAGIC + bytes([THETA_CODEC_VERSION]) + THETA_TYPE_CODES[dtype]
+
+def encode_theta(vector, dtype=THETA_DTYPE):
+    dtype = np.dtype(dtype).newbyteorder('<')
+    return _theta_header(dtype) + np.asarray(vector, dtype=dtype).tobytes()
+
+#theta 批量编码: (N, K) 矩阵 -> N 个 BLOB
+def encode_theta_rows(matrix, dtype=THETA_DTYPE):
+    dtype = np.dtype(dtype).newbyteorder('<')
+    header = _theta_header(dtype)
+    matrix = np.ascontiguousarray(matrix, dtype=dtype)
+    return [header + row.tobytes() for row in matrix]
+
+#theta 解码: BLOB 或旧版 JSON 文本 -> float64 一维数组
+def decode_theta(value):
+    if isinstance(value, str):
+        return np.asarray(json.loads(value), dtype=np.float64)
+    value = bytes(value)
+    if value[:2] != THETA_MAGIC:
+        return np.asarray(json.loads(value.decode('utf-8')), dtype=np.float64)
+    if value[2] != THETA_CODEC_VERSION:
+        raise ValueError(f"不支持的 theta 编码版本: {value[2]}")
+    dtype = THETA_CODE_TYPES[value[3:4]]
+    return np.frombuffer(value, dtype=dtype, offset=4).astype(np.float64)
+
+#theta 批量解码: 多个 BLOB -> 连续的 (N, K) float64 矩阵
+def decode_theta_matrix(values):
+    values = list(values)
+    if not values:
+        return np.empty((0, 0))
+    first = values[0]
+    # 快速路径: 全部为同一版本/类型/长度的二进制值时，拼接后一次 frombuffer
+    if isinstance(first, bytes) and first[:2] == THETA_MAGIC:
+        header, size = first[:4], len(first)
+        if all(isinstance(v, bytes) and len(v) == size and v[:4] == header for v in values):
+            dtype = THETA_CODE_TYPES[header[3:4]]
+            payload = b''.join([v[4:] for v in values])
+            return np.frombuffer(payload, dtype=dtype).reshape(len(values), -1).astype(np.float64)
+    return np.vstack([decode_theta(v) for v in values])
+
+#记录参数函数
+def record_simulation_parameters(params, conn=None, doc_length=None, seed=None, seed_stream=None, status='running',
+                                 corpus_key=None, gen_shards=1, test_fraction=None):
+    """
+    params 为 (K, V, N, alpha, sim_date)；doc_length / seed / seed_stream / gen_shards / corpus_key / test_fraction 可选，
+    用于精确复现、断点续跑与语料复用。
+    """
     run_id = None
     try:
-        cursor = conn.cursor()
-        sql = "INSERT INTO sim_parameters (K_topics, V_size, N_docs, alpha_param, sim_date) VALUES (?, ?, ?, ?, ?)"
-        cursor.execute(sql, params)
-        run_id = cursor.lastrowid #获取ID
-        conn.commit()
+        with _use_connection(conn) as conn:
+            cursor = conn.cursor()
+            sql = ("INSERT INTO sim_parameters (K_topics, V_size, N_docs, alpha_param, sim_date, doc_length, seed, seed_stream, "
+                   "status, corpus_key, gen_shards, test_fraction) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+            cursor.execute(sql, tuple(params) + (doc_length, seed, seed_stream, status, corpus_key, gen_shards,
+                                                 test_fraction))
+            run_id = cursor.lastrowid #获取ID
     except sqlite3.Error as e:
         print(f"参数记录失败: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+        run_id = None
     return run_id
 
 #批量插入文档
-def bulk_insert_documents(documents_data):
-    conn = get_db_connection()
-    if conn is None: return False
-    
+def bulk_insert_documents(documents_data, conn=None):
     insert_success = False
     try:
-        cursor = conn.cursor()
-        sql = "INSERT INTO documents_data (run_id, simulated_text, true_theta_vector) VALUES (?, ?, ?)"
-        cursor.executemany(sql, documents_data) #批量入库
-        conn.commit()
+        with _use_connection(conn) as conn:
+            cursor = conn.cursor()
+            sql = "INSERT INTO documents_data (run_id, simulated_text, true_theta_vector, word_counts) VALUES (?, ?, ?, ?)"
+            cursor.executemany(sql, documents_data) #批量入库
         print(f"{len(documents_data)} 条文档数据批量入库成功。")
         insert_success = True
-            
+
     except sqlite3.Error as e:
         print(f"文档批量入库失败: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
     return insert_success
 
+#流式批量插入文档: 逐批写入，按检查点提交
+def stream_insert_documents(batches, checkpoint_every=INSERT_CHECKPOINT_BATCHES, conn=None):
+    """
+    batches 为可迭代的数据元组批次 (如 stat_sim.iter_document_batches)，边生成边入库。
+    每写入 checkpoint_every 个批次提交一次；checkpoint_every=None 表示不设检查点，
+    由会话 (或调用方的 transaction) 在最后一次性提交。
+    返回成功写入的文档数，失败时返回 None (已提交的检查点保留)。
+    """
+    n_inserted = 0
+    try:
+        with _use_connection(conn) as conn:
+            cursor = conn.cursor()
+            sql = "INSERT INTO documents_data (run_id, simulated_text, true_theta_vector, word_counts) VALUES (?, ?, ?, ?)"
+            for i, batch in enumerate(batches, start=1):
+                cursor.executemany(sql, batch)
+                n_inserted += len(batch)
+                if checkpoint_every and i % checkpoint_every == 0:
+                    conn.commit()
+        print(f"{n_inserted} 条文档数据流式入库成功。")
+
+    except sqlite3.Error as e:
+        print(f"文档流式入库失败: {e}")
+        n_inserted = None
+    return n_inserted
+
 #数据提取函数（从数据存储回到数据分析）
-def fetch_documents_for_analysis(run_id):
-    conn = get_db_connection()
-    if conn is None: return None
-    
+def fetch_documents_for_analysis(run_id, conn=None):
     data_list = []
     try:
-        cursor = conn.cursor()
-        sql = "SELECT doc_id, simulated_text, true_theta_vector FROM documents_data WHERE run_id = ?"
-        cursor.execute(sql, (run_id,))
-        
-        results = cursor.fetchall()
-        
+        with _use_connection(conn) as conn:
+            cursor = conn.cursor()
+            sql = "SELECT doc_id, simulated_text, true_theta_vector FROM documents_data WHERE run_id = ?"
+            cursor.execute(sql, (run_id,))
+
+            results = cursor.fetchall()
+
         for row in results:
-            true_theta = json.loads(row['true_theta_vector'])#反解析 
+            true_theta = decode_theta(row['true_theta_vector']).tolist()#反解析
             data_list.append({
                 'doc_id': row['doc_id'],
                 'text': row['simulated_text'],
                 'true_theta': true_theta
             })
-            
+
         print(f"从数据库成功提取 {len(data_list)} 条文档数据。")
-            
+
     except Exception as e:
         print(f"数据提取失败: {e}")
         data_list = None
-    finally:
-        conn.close()
     return data_list
 
-#批量插入分析结果
-def bulk_insert_analysis_results(results_list):
-    conn = get_db_connection()
-    if conn is None: return False
-    
+#文本模式旧文档的词表查找表
+def _build_word_index(vocabulary):
+    if vocabulary is None:
+        return None
+    return {word: i for i, word in enumerate(vocabulary)}
+
+#单行文档的 (词索引, 词频): 优先解码稀疏 BLOB，文本模式的旧文档按词表计数
+def _row_word_counts(row, word_index):
+    return _word_counts(row['doc_id'], row['simulated_text'], row['word_counts'], word_index)
+
+def _word_counts(doc_id, simulated_text, word_counts, word_index):
+    if word_counts is not None:
+        return decode_sparse_counts(word_counts)
+    if word_index is None:
+        raise ValueError(f"doc_id {doc_id} 以文本格式存储，需要传入 vocabulary")
+    tokens = [word_index[w] for w in simulated_text.split() if w in word_index]
+    return np.unique(np.asarray(tokens, dtype=SPARSE_DTYPE), return_counts=True)
+
+# 流式读取的排序方式
+READ_ORDERS = {'asc': "ORDER BY doc_id", 'desc': "ORDER BY doc_id DESC", None: ""}
+
+#流式读取: 一次遍历游标，直接填入预分配的 CSR 缓冲区与 (N, K) theta 数组
+def read_corpus(run_id, V, vocabulary=None, start=None, stop=None, order='asc', arraysize=READ_ARRAYSIZE, conn=None):
+    """
+    返回 (doc_ids, true_thetas, dtm)：doc_ids 为 int64 数组，true_thetas 为 (N, K) float64 数组，
+    dtm 为 N x V 的 csr_matrix (data 为 float64，LDA 可直接使用、无需再转换复制)。
+    start / stop 为按 order 排序后的行号区间 [start, stop)；order 为 'asc' / 'desc' / None (不排序)。
+    游标每次取 arraysize 行，行以普通元组返回；文档数与非零元素数先由 SQL 统计
+    (稀疏 BLOB 每个非零元素占 8 字节)，缓冲区按最终大小一次分配，峰值内存约等于结果矩阵本身。
+    出错时直接抛出异常。
+    """
+    limit = -1 if stop is None else max(stop - (start or 0), 0)
+    source = (f"SELECT doc_id, simulated_text, true_theta_vector, word_counts FROM documents_data "
+              f"WHERE run_id = ? {READ_ORDERS[order]} LIMIT ? OFFSET ?")
+    params = (run_id, limit, start or 0)
+    word_index = _build_word_index(vocabulary)
+
+    with _use_connection(conn) as conn:
+        n_docs, blob_bytes, n_text = conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(length(word_counts)), 0), COALESCE(SUM(word_counts IS NULL), 0) "
+            f"FROM (SELECT word_counts FROM documents_data WHERE run_id = ? {READ_ORDERS[order]} LIMIT ? OFFSET ?)",
+            params).fetchone()
+        # 文本模式的旧文档无法预知非零元素数，先按估计值分配，不足时再扩容
+        capacity = blob_bytes // (2 * SPARSE_DTYPE.itemsize) + n_text * 64
+        index_dtype = np.int32 if capacity < np.iinfo(np.int32).max else np.int64
+        doc_ids = np.empty(n_docs, dtype=np.int64)
+        data = np.empty(capacity, dtype=np.float64)
+        indices = np.empty(capacity, dtype=index_dtype)
+        indptr = np.zeros(n_docs + 1, dtype=index_dtype)
+        theta = None
+
+        cursor = conn.cursor()
+        cursor.row_factory = None # 普通元组，省去 sqlite3.Row 的包装
+        cursor.arraysize = arraysize
+        cursor.execute(source, params)
+        row_pos, nnz = 0, 0
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            n_rows = len(rows)
+            block_theta = decode_theta_matrix([row[2] for row in rows])
+            if theta is None:
+                theta = np.empty((n_docs, block_theta.shape[1]), dtype=np.float64)
+            theta[row_pos:row_pos + n_rows] = block_theta
+
+            for doc_id, simulated_text, _, word_counts in rows:
+                word_ids, counts = _word_counts(doc_id, simulated_text, word_counts, word_index)
+                end = nnz + len(word_ids)
+                if end > len(data):
+                    data = np.resize(data, max(end, 2 * len(data)))
+                    indices = np.resize(indices, len(data))
+                data[nnz:end] = counts
+                indices[nnz:end] = word_ids
+                nnz = end
+                doc_ids[row_pos] = doc_id
+                row_pos += 1
+                indptr[row_pos] = nnz
+
+    if theta is None:
+        theta = np.empty((0, 0))
+    # scipy 只在构建矩阵时导入，report 等只查询汇总的命令不需要加载它
+    from scipy.sparse import csr_matrix
+    dtm = csr_matrix((data[:nnz], indices[:nnz], indptr), shape=(n_docs, V), copy=False)
+    return doc_ids, theta, dtm
+
+#数据提取函数: 直接构建 CSR 文档-词频矩阵，无需分词
+def fetch_document_term_matrix(run_id, V, vocabulary=None, conn=None):
+    """
+    返回 (doc_ids, true_thetas, dtm)，true_thetas 为 (N, K) 矩阵，dtm 为 N x V 的 scipy.sparse.csr_matrix。
+    稀疏模式入库的文档直接解码 word_counts；
+    文本模式 (word_counts 为空) 的旧文档按 vocabulary 查表计数，此时需要传入 vocabulary。
+    """
+    result = None
     try:
+        doc_ids, true_thetas, dtm = read_corpus(run_id, V, vocabulary, conn=conn)
+        result = (doc_ids.tolist(), true_thetas, dtm)
+        print(f"从数据库成功提取 {len(doc_ids)} 条文档数据 (稀疏矩阵, {dtm.nnz} 个非零元素)。")
+
+    except Exception as e:
+        print(f"数据提取失败: {e}")
+        result = None
+    return result
+
+#查找参数与种子完全相同且已完成 (有最终分数) 的运行，没有时返回 None
+def find_completed_run(K_topics, V_size, N_docs, alpha_param, doc_length, seed, seed_stream=None, conn=None):
+    sql = ("SELECT run_id FROM sim_parameters WHERE K_topics = ? AND V_size = ? AND N_docs = ? AND alpha_param = ? "
+           "AND doc_length = ? AND seed = ? AND seed_stream IS ? AND final_similarity_score IS NOT NULL "
+           "ORDER BY run_id LIMIT 1")
+    with _use_connection(conn) as conn:
+        row = conn.execute(sql, (K_topics, V_size, N_docs, alpha_param, doc_length, seed, seed_stream)).fetchone()
+    return None if row is None else row[0]
+
+#查找持有相同语料 (corpus_key 相同) 且已完成的运行，其 documents_data 行可直接复用；没有时返回 None
+def find_corpus_run(corpus_key, conn=None):
+    if corpus_key is None:
+        return None
+    sql = ("SELECT run_id FROM sim_parameters WHERE corpus_key = ? AND corpus_run_id IS NULL "
+           "AND status = 'completed' ORDER BY run_id LIMIT 1")
+    with _use_connection(conn) as conn:
+        row = conn.execute(sql, (corpus_key,)).fetchone()
+    return None if row is None else row[0]
+
+#记录本次运行复用的语料来源
+def link_corpus_run(run_id, corpus_run_id, conn=None):
+    with _use_connection(conn) as conn:
+        conn.execute("UPDATE sim_parameters SET corpus_run_id = ? WHERE run_id = ?", (corpus_run_id, run_id))
+
+#读取某次运行的参数行 (字典)，不存在时返回 None；documents_run_id 为其文档实际所在的 run
+def fetch_run_parameters(run_id, conn=None):
+    sql = "SELECT *, COALESCE(corpus_run_id, run_id) AS documents_run_id FROM sim_parameters WHERE run_id = ?"
+    with _use_connection(conn) as conn:
+        row = conn.execute(sql, (run_id,)).fetchone()
+    return None if row is None else dict(row)
+
+#最近的若干次运行 (按 run_id 倒序)，供命令行 report 列出
+def fetch_recent_runs(limit=20, conn=None):
+    sql = ("SELECT run_id, K_topics, V_size, N_docs, alpha_param, doc_length, seed, status, sim_date, "
+           "final_similarity_score, heldout_perplexity, corpus_run_id, experiment_id "
+           "FROM sim_parameters ORDER BY run_id DESC LIMIT ?")
+    with _use_connection(conn) as conn:
+        return [dict(row) for row in conn.execute(sql, (limit,)).fetchall()]
+
+#某次运行的全部 doc_id (按顺序)
+def fetch_doc_ids(run_id, conn=None):
+    with _use_connection(conn) as conn:
+        rows = conn.execute("SELECT doc_id FROM documents_data WHERE run_id = ? ORDER BY doc_id", (run_id,)).fetchall()
+    return [row[0] for row in rows]
+
+#统计某次运行的文档数
+def count_documents(run_id, conn=None):
+    with _use_connection(conn) as conn:
+        return conn.execute("SELECT COUNT(*) FROM documents_data WHERE run_id = ?", (run_id,)).fetchone()[0]
+
+#流式提取: 按 doc_id 顺序逐批产出 (doc_ids, dtm_batch)，内存中只保留一个批次
+def iter_dtm_batches(run_id, V, batch_size, vocabulary=None, conn=None):
+    """
+    供小批量 (online) LDA 训练直接从数据库游标读取，不构建完整的文档-词频矩阵。
+    每个批次的 dtm_batch 为 len(doc_ids) x V 的 csr_matrix。出错时直接抛出异常。
+    """
+    from scipy.sparse import csr_matrix
+    word_index = _build_word_index(vocabulary)
+    with _use_connection(conn) as conn:
         cursor = conn.cursor()
-        sql = "INSERT INTO analysis_results (doc_id, run_id, predicted_theta_vector, cosine_similarity) VALUES (?, ?, ?, ?)"
-        cursor.executemany(sql, results_list)
-        conn.commit()
+        sql = "SELECT doc_id, simulated_text, word_counts FROM documents_data WHERE run_id = ? ORDER BY doc_id"
+        cursor.execute(sql, (run_id,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            doc_ids, indices, data, indptr = [], [], [], [0]
+            for row in rows:
+                word_ids, counts = _row_word_counts(row, word_index)
+                doc_ids.append(row['doc_id'])
+                indices.append(word_ids)
+                data.append(counts)
+                indptr.append(indptr[-1] + len(word_ids))
+            dtm_batch = csr_matrix((np.concatenate(data), np.concatenate(indices), np.asarray(indptr)),
+                                   shape=(len(rows), V))
+            yield doc_ids, dtm_batch
+
+#theta 矩阵提取: 一次返回整个 run 的 (N, K) theta 矩阵
+def fetch_theta_matrix(run_id, which='true', conn=None):
+    """
+    which='true' 读取 documents_data.true_theta_vector，
+    which='pred' 读取 analysis_results.predicted_theta_vector。
+    返回 (doc_ids, theta_matrix)，按 doc_id 排序。
+    """
+    queries = {
+        'true': "SELECT doc_id, true_theta_vector FROM documents_data WHERE run_id = ? ORDER BY doc_id",
+        'pred': "SELECT doc_id, predicted_theta_vector FROM analysis_results WHERE run_id = ? ORDER BY doc_id",
+    }
+    result = None
+    try:
+        with _use_connection(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute(queries[which], (run_id,))
+            rows = cursor.fetchall()
+        doc_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        result = (doc_ids, decode_theta_matrix(row[1] for row in rows))
+    except Exception as e:
+        print(f"theta 矩阵提取失败: {e}")
+        result = None
+    return result
+
+#组装分析结果元组: (doc_id, run_id, theta_blob, 相似度, 划分, 对数似然, 真实模型对数似然, 词数)；测试文档的似然与词数只针对留出的一半
+def build_analysis_rows(doc_ids, run_id, aligned_theta, similarities, test_mask=None, likelihood=None):
+    doc_ids = np.asarray(doc_ids).tolist() # sqlite3 不能直接绑定 numpy 整数
+    n_docs = len(doc_ids)
+    splits = ['train'] * n_docs if test_mask is None else np.where(test_mask, 'test', 'train').tolist()
+    if likelihood is None:
+        log_likelihood = true_log_likelihood = token_count = [None] * n_docs
+    else:
+        log_likelihood = likelihood['log_likelihood'].tolist()
+        true_log_likelihood = likelihood['true_log_likelihood'].tolist()
+        token_count = likelihood['token_count'].astype(np.int64).tolist()
+    return list(zip(doc_ids, [run_id] * n_docs, encode_theta_rows(aligned_theta), np.asarray(similarities).tolist(),
+                    splits, log_likelihood, true_log_likelihood, token_count))
+
+#批量插入分析结果 (元组为旧格式的 4 列，或 build_analysis_rows 产生的 8 列)
+def bulk_insert_analysis_results(results_list, conn=None):
+    try:
+        with _use_connection(conn) as conn:
+            cursor = conn.cursor()
+            if results_list and len(results_list[0]) == 4:
+                sql = "INSERT INTO analysis_results (doc_id, run_id, predicted_theta_vector, cosine_similarity) VALUES (?, ?, ?, ?)"
+            else:
+                sql = ("INSERT INTO analysis_results (doc_id, run_id, predicted_theta_vector, cosine_similarity, "
+                       "split, log_likelihood, true_log_likelihood, token_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+            cursor.executemany(sql, results_list)
         print(f"{len(results_list)} 条分析结果批量入库成功。")
-            
+
     except sqlite3.Error as e:
         print(f"分析结果批量入库失败: {e}")
-        conn.rollback()
         return False
-    finally:
-        conn.close()
     return True
 
-#更新模拟结果
-def update_simulation_results(run_id, final_similarity_score):
+#更新模拟结果: 不传 final_similarity_score 时直接在 SQL 中对 analysis_results 求平均
+def update_simulation_results(run_id, final_similarity_score=None, conn=None):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        sql = "UPDATE sim_parameters SET final_similarity_score = ? WHERE run_id = ?"
-        cursor.execute(sql, (final_similarity_score, run_id))
-        conn.commit()
-        conn.close()
+        with _use_connection(conn) as conn:
+            cursor = conn.cursor()
+            if final_similarity_score is None:
+                sql = ("UPDATE sim_parameters SET final_similarity_score = "
+                       "(SELECT AVG(cosine_similarity) FROM analysis_results WHERE run_id = ?) WHERE run_id = ?")
+                cursor.execute(sql, (run_id, run_id))
+            else:
+                sql = "UPDATE sim_parameters SET final_similarity_score = ? WHERE run_id = ?"
+                cursor.execute(sql, (final_similarity_score, run_id))
         print(f"[成功] run_id {run_id} 的最终平均相似度分数已更新。")
         return True
     except Exception as e:
         print(f"[失败] 更新模拟结果时出错: {e}")
-        return False
\ No newline at end of file
+        return False
+
+#更新似然评估的汇总结果 (likelihood 为 evaluation.evaluate_likelihood 的返回值)；heldout_perplexity 为测试集文档补全困惑度
+def update_run_likelihood(run_id, test_fraction, likelihood, conn=None):
+    try:
+        with _use_connection(conn) as conn:
+            sql = ("UPDATE sim_parameters SET test_fraction = ?, heldout_log_likelihood = ?, heldout_perplexity = ?, "
+                   "true_log_likelihood = ?, true_perplexity = ? WHERE run_id = ?")
+            conn.execute(sql, (test_fraction, likelihood['heldout_log_likelihood'], likelihood['heldout_perplexity'],
+                               likelihood['true_log_likelihood_total'], likelihood['true_perplexity'], run_id))
+        return True
+    except sqlite3.Error as e:
+        print(f"[失败] 更新似然评估结果时出错: {e}")
+        return False
+
+#更新运行状态 (running / completed / aborted / failed)
+def update_run_status(run_id, status, conn=None):
+    try:
+        with _use_connection(conn) as conn:
+            conn.execute("UPDATE sim_parameters SET status = ? WHERE run_id = ?", (status, run_id))
+        return True
+    except sqlite3.Error as e:
+        print(f"[失败] 更新运行状态时出错: {e}")
+        return False
+
+# 运行的阶段，按执行顺序；每个阶段完成时写入 run_stages，续跑时从第一个未完成的阶段开始
+RUN_STAGES = ('params', 'documents', 'training', 'results', 'score')
+
+# 按 run_id 存放数据的表 (清理时按此顺序删除，sim_parameters 最后)
+RUN_TABLES = ('analysis_results', 'run_metrics', 'experiment_runs', 'run_stages', 'documents_data', 'sim_parameters')
+
+#标记若干阶段已完成 (由调用方的事务与该阶段的写入一起提交)
+def mark_stages_completed(run_id, stages, conn=None):
+    for stage in stages:
+        if stage not in RUN_STAGES:
+            raise ValueError(f"未知的运行阶段: {stage}")
+    with _use_connection(conn) as conn:
+        sql = "INSERT OR REPLACE INTO run_stages (run_id, stage, completed_at) VALUES (?, ?, datetime('now', 'localtime'))"
+        conn.executemany(sql, [(run_id, stage) for stage in stages])
+
+#某次运行已完成的阶段 (按 RUN_STAGES 的顺序)
+def fetch_completed_stages(run_id, conn=None):
+    with _use_connection(conn) as conn:
+        rows = conn.execute("SELECT stage FROM run_stages WHERE run_id = ?", (run_id,)).fetchall()
+    completed = {row[0] for row in rows}
+    return [stage for stage in RUN_STAGES if stage in completed]
+
+#分批删除某个 run 在表中的行，每批单独提交，避免长时间持有写锁；返回删除的行数
+def delete_run_rows(table, run_id, batch_size=CLEANUP_BATCH_SIZE, conn=None):
+    if table not in RUN_TABLES:
+        raise ValueError(f"不支持的表: {table}")
+    sql = f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE run_id = ? LIMIT ?)"
+    n_deleted = 0
+    with _use_connection(conn) as conn:
+        while True:
+            cursor = conn.execute(sql, (run_id, batch_size))
+            conn.commit()
+            n_deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+    return n_deleted
+
+#清理中断 / 失败运行留下的行，以及 run_id 已不在 sim_parameters 中的孤立行
+def cleanup_abandoned_runs(statuses=('aborted', 'failed'), batch_size=CLEANUP_BATCH_SIZE, dry_run=False, conn=None):
+    """
+    状态属于 statuses 的运行整体删除 (参数行、文档、分析结果、阶段指标与阶段状态)。
+    文档仍被其他保留的运行通过 corpus_run_id 复用时，保留其参数行、文档与阶段状态，只删除分析结果与阶段指标。
+    dry_run=True 时只统计将删除的行数。
+    返回 {'runs': 删除的 run_id, 'kept_corpus_runs': 因语料被复用而保留的 run_id, 'rows': {表名: 行数}}，出错时返回 None。
+    """
+    placeholders = ", ".join("?" * len(statuses))
+    try:
+        with _use_connection(conn) as conn:
+            sql = f"SELECT run_id FROM sim_parameters WHERE status IN ({placeholders}) ORDER BY run_id"
+            abandoned = [row[0] for row in conn.execute(sql, tuple(statuses)).fetchall()]
+            sql = (f"SELECT DISTINCT corpus_run_id FROM sim_parameters WHERE corpus_run_id IS NOT NULL "
+                   f"AND (status IS NULL OR status NOT IN ({placeholders}))")
+            linked = {row[0] for row in conn.execute(sql, tuple(statuses)).fetchall()}
+            # 孤立行: 所属 run 的参数行已不存在
+            orphaned = set()
+            for table in RUN_TABLES[:-1]:
+                sql = (f"SELECT DISTINCT run_id FROM {table} "
+                       f"WHERE run_id NOT IN (SELECT run_id FROM sim_parameters)")
+                orphaned.update(row[0] for row in conn.execute(sql).fetchall())
+
+            plan = []
+            for run_id in abandoned:
+                tables = RUN_TABLES[:2] if run_id in linked else RUN_TABLES
+                plan.append((run_id, tables))
+            plan.extend((run_id, RUN_TABLES[:2] if run_id in linked else RUN_TABLES[:-1]) for run_id in sorted(orphaned))
+
+            counts = {table: 0 for table in RUN_TABLES}
+            for run_id, tables in plan:
+                for table in tables:
+                    if dry_run:
+                        sql = f"SELECT COUNT(*) FROM {table} WHERE run_id = ?"
+                        counts[table] += conn.execute(sql, (run_id,)).fetchone()[0]
+                    else:
+                        counts[table] += delete_run_rows(table, run_id, batch_size, conn=conn)
+    except sqlite3.Error as e:
+        print(f"[失败] 清理运行数据时出错: {e}")
+        return None
+    return {
+        'runs': [run_id for run_id in abandoned if run_id not in linked] + sorted(orphaned),
+        'kept_corpus_runs': [run_id for run_id in abandoned if run_id in linked],
+        'rows': counts,
+    }
+
+#整理数据库文件，回收删除后留下的空闲页 (需要在事务之外执行)
+def vacuum_database(conn=None):
+    with _use_connection(conn) as conn:
+        conn.commit()
+        conn.execute("VACUUM")
+
+#写入阶段指标 (metrics 为 metrics.stage_timer 产生的记录列表)；续跑时接在已有记录之后
+def insert_run_metrics(run_id, metrics, conn=None):
+    try:
+        with _use_connection(conn) as conn:
+            sql = "SELECT COALESCE(MAX(stage_order) + 1, 0) FROM run_metrics WHERE run_id = ?"
+            start = conn.execute(sql, (run_id,)).fetchone()[0]
+            rows = [(run_id, order, record['stage'], record['wall_seconds'], record['cpu_seconds'],
+                     record['rss_kb'], record['rss_delta_kb'], record['peak_rss_kb'], record['peak_traced_kb'],
+                     record['n_rows'])
+                    for order, record in enumerate(metrics, start=start)]
+            sql = ("INSERT INTO run_metrics (run_id, stage_order, stage, wall_seconds, cpu_seconds, "
+                   "rss_kb, rss_delta_kb, peak_rss_kb, peak_traced_kb, n_rows) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+            conn.executemany(sql, rows)
+    except sqlite3.Error as e:
+        print(f"阶段指标入库失败: {e}")
+        return False
+    return True
+
+#读取某次运行的阶段指标 (按阶段顺序)
+def fetch_run_metrics(run_id, conn=None):
+    sql = ("SELECT stage, wall_seconds, cpu_seconds, rss_kb, rss_delta_kb, peak_rss_kb, peak_traced_kb, n_rows "
+           "FROM run_metrics WHERE run_id = ? ORDER BY stage_order")
+    with _use_connection(conn) as conn:
+        return [dict(row) for row in conn.execute(sql, (run_id,)).fetchall()]
+
+#单次运行的相似度统计，全部在 SQLite 中完成聚合
+def fetch_run_summary(run_id, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), bins=10, conn=None):
+    """
+    返回 {'n', 'mean', 'std', 'min', 'max', 'quantiles': {q: 值}, 'histogram': [(下界, 上界, 计数)]}，
+    std 为样本标准差，分位数按有序位置线性插值。该 run 没有分析结果时返回 None。
+    """
+    summary = None
+    try:
+        with _use_connection(conn) as conn:
+            cursor = conn.cursor()
+            sql = ("SELECT COUNT(*), AVG(cosine_similarity), MIN(cosine_similarity), MAX(cosine_similarity) "
+                   "FROM analysis_results WHERE run_id = ?")
+            n, mean, lo, hi = cursor.execute(sql, (run_id,)).fetchone()
+            if n == 0:
+                return None
+
+            # 两遍法计算方差，避免 E[x^2] - E[x]^2 的数值抵消
+            sql = "SELECT SUM((cosine_similarity - ?) * (cosine_similarity - ?)) FROM analysis_results WHERE run_id = ?"
+            sum_sq = cursor.execute(sql, (mean, mean, run_id)).fetchone()[0]
+            std = (sum_sq / (n - 1)) ** 0.5 if n > 1 else 0.0
+
+            # 分位数: 借助 (run_id, cosine_similarity) 索引按序定位，只取相邻两行做插值
+            quantile_values = {}
+            sql = ("SELECT cosine_similarity FROM analysis_results WHERE run_id = ? "
+                   "ORDER BY cosine_similarity LIMIT 2 OFFSET ?")
+            for q in quantiles:
+                position = q * (n - 1)
+                base = int(position)
+                pair = [row[0] for row in cursor.execute(sql, (run_id, base)).fetchall()]
+                upper = pair[1] if len(pair) > 1 else pair[0]
+                quantile_values[q] = pair[0] + (upper - pair[0]) * (position - base)
+
+            # 直方图: 在 [min, max] 上等宽分桶后 GROUP BY
+            width = (hi - lo) / bins
+            histogram = [[lo + i * width, lo + (i + 1) * width, 0] for i in range(bins)]
+            if width > 0:
+                sql = ("SELECT MIN(CAST((cosine_similarity - ?) / ? AS INTEGER), ?) AS bucket, COUNT(*) "
+                       "FROM analysis_results WHERE run_id = ? GROUP BY bucket")
+                for bucket, count in cursor.execute(sql, (lo, width, bins - 1, run_id)):
+                    histogram[bucket][2] = count
+            else:
+                histogram[0][2] = n
+
+        summary = {
+            'n': n, 'mean': mean, 'std': std, 'min': lo, 'max': hi,
+            'quantiles': quantile_values,
+            'histogram': [tuple(bucket) for bucket in histogram],
+        }
+    except Exception as e:
+        print(f"运行统计查询失败: {e}")
+        summary = None
+    return summary
+
+#新建实验记录，返回 experiment_id
+def create_experiment(name, config, replicates, seed, n_bootstrap, confidence, created, conn=None):
+    with _use_connection(conn) as conn:
+        sql = ("INSERT INTO experiments (name, created, config_json, replicates, seed, n_bootstrap, confidence) "
+               "VALUES (?, ?, ?, ?, ?, ?, ?)")
+        cursor = conn.execute(sql, (name, created, json.dumps(config, ensure_ascii=False), replicates, seed,
+                                    n_bootstrap, confidence))
+        return cursor.lastrowid
+
+#把若干运行关联到实验 (追加关联，已属于其他实验的运行不会从原实验中移走)
+def link_runs_to_experiment(experiment_id, run_ids, conn=None):
+    rows = [(experiment_id, run_id) for run_id in run_ids]
+    with _use_connection(conn) as conn:
+        conn.executemany("INSERT OR IGNORE INTO experiment_runs (experiment_id, run_id) VALUES (?, ?)", rows)
+        conn.executemany("UPDATE sim_parameters SET experiment_id = ? WHERE run_id = ? AND experiment_id IS NULL", rows)
+
+#保存实验的汇总结果 (置信区间等，JSON)
+def update_experiment_results(experiment_id, results, conn=None):
+    with _use_connection(conn) as conn:
+        conn.execute("UPDATE experiments SET results_json = ? WHERE experiment_id = ?",
+                     (json.dumps(results, ensure_ascii=False), experiment_id))
+
+#实验的各重复运行 (run_id, 最终平均相似度, 测试集困惑度)
+def fetch_experiment_runs(experiment_id, conn=None):
+    sql = ("SELECT p.run_id, p.final_similarity_score, p.heldout_perplexity FROM experiment_runs e "
+           "JOIN sim_parameters p ON p.run_id = e.run_id WHERE e.experiment_id = ? ORDER BY p.run_id")
+    with _use_connection(conn) as conn:
+        return [tuple(row) for row in conn.execute(sql, (experiment_id,)).fetchall()]
+
+#分析结果数组: 一次读出若干运行的逐文档相似度、对数似然、词数与测试集标记，供自助法等向量化统计使用；
+# 按 run_id 排序，同一运行的文档连续排列
+def fetch_analysis_arrays(run_ids, conn=None):
+    run_ids = list(run_ids)
+    placeholders = ", ".join("?" * len(run_ids))
+    sql = ("SELECT cosine_similarity, log_likelihood, token_count, split = 'test', run_id FROM analysis_results "
+           f"WHERE run_id IN ({placeholders}) ORDER BY run_id, doc_id")
+    with _use_connection(conn) as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        rows = cursor.execute(sql, run_ids).fetchall()
+    # 旧数据没有似然列 (NULL)，转换为 nan / 0
+    columns = np.array(rows, dtype=np.float64).reshape(-1, 5) if rows else np.empty((0, 5))
+    return {
+        'similarity': columns[:, 0],
+        'log_likelihood': columns[:, 1],
+        'token_count': np.nan_to_num(columns[:, 2]),
+        'is_test': columns[:, 3] == 1,
+        'run_id': columns[:, 4].astype(np.int64),
+    }
+
+# 跨运行对比时允许分组的参数列
+RUN_GROUP_COLUMNS = ('K_topics', 'V_size', 'N_docs', 'alpha_param')
+
+#跨运行对比: 按参数分组汇总已完成运行的最终平均相似度
+def compare_runs(group_by=('K_topics', 'alpha_param', 'N_docs'), conn=None):
+    """
+    返回列表，每个元素为 {分组列..., 'n_runs', 'mean_score', 'std_score', 'min_score', 'max_score'}，
+    std_score 为样本标准差 (只有一次运行时为 0)。
+    """
+    for column in group_by:
+        if column not in RUN_GROUP_COLUMNS:
+            raise ValueError(f"不支持的分组列: {column}")
+    columns = ", ".join(group_by)
+    sql = f"""
+        WITH completed AS (
+            SELECT {columns}, final_similarity_score AS score,
+                   AVG(final_similarity_score) OVER (PARTITION BY {columns}) AS group_mean
+            FROM sim_parameters
+            WHERE final_similarity_score IS NOT NULL
+        )
+        SELECT {columns}, COUNT(*), AVG(score),
+               SUM((score - group_mean) * (score - group_mean)), MIN(score), MAX(score)
+        FROM completed
+        GROUP BY {columns}
+        ORDER BY {columns}
+    """
+    comparison = []
+    try:
+        with _use_connection(conn) as conn:
+            rows = conn.execute(sql).fetchall()
+        for row in rows:
+            row = tuple(row)
+            n_runs, mean_score, sum_sq, min_score, max_score = row[len(group_by):]
+            entry = dict(zip(group_by, row[:len(group_by)]))
+            entry.update({
+                'n_runs': n_runs,
+                'mean_score': mean_score,
+                'std_score': (sum_sq / (n_runs - 1)) ** 0.5 if n_runs > 1 else 0.0,
+                'min_score': min_score,
+                'max_score': max_score,
+            })
+            comparison.append(entry)
+    except Exception as e:
+        print(f"跨运行对比查询失败: {e}")
+        comparison = None
+    return comparison
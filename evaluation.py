@@ -0,0 +1,208 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import linear_sum_assignment
+
+from config import EVAL_CHUNK_SIZE, COMPLETION_MAX_ITER
+
+# 批量评估: 对整个 (N, K) theta 矩阵一次性计算，不再逐文档循环
+
+#逐行余弦相似度: 两个 (N, K) 矩阵 -> 长度 N 的相似度向量，零向量对应的相似度记为 0
+def row_cosine_similarity(matrix_a, matrix_b):
+    matrix_a = np.asarray(matrix_a, dtype=np.float64)
+    matrix_b = np.asarray(matrix_b, dtype=np.float64)
+
+    dot_products = np.einsum('ij,ij->i', matrix_a, matrix_b)
+    norms = np.linalg.norm(matrix_a, axis=1) * np.linalg.norm(matrix_b, axis=1)
+
+    similarities = np.zeros_like(dot_products)
+    np.divide(dot_products, norms, out=similarities, where=norms > 0)
+    return similarities
+
+#主题对齐: LDA 学到的主题编号与真实主题编号不一定一致 (标签交换)
+def align_topics(components, phi_matrix):
+    """
+    用匈牙利算法在学到的主题 (components, K x V) 与真实主题 (phi_matrix, K x V) 之间
+    寻找使主题-词分布余弦相似度之和最大的一一对应。
+    返回 (permutation, topic_similarity)：theta_pred[:, permutation] 的第 k 列对应真实主题 k，
+    topic_similarity[k] 为真实主题 k 与其匹配主题的余弦相似度。
+    """
+    learned = np.asarray(components, dtype=np.float64)
+    learned = learned / learned.sum(axis=1, keepdims=True)
+    true_topics = np.asarray(phi_matrix, dtype=np.float64)
+
+    learned_unit = learned / np.linalg.norm(learned, axis=1, keepdims=True)
+    true_unit = true_topics / np.linalg.norm(true_topics, axis=1, keepdims=True)
+    similarity_matrix = true_unit @ learned_unit.T # [真实主题, 学到的主题]
+
+    true_index, permutation = linear_sum_assignment(similarity_matrix, maximize=True)
+    return permutation[np.argsort(true_index)], similarity_matrix[true_index, permutation]
+
+#整体评估: 先对齐主题，再计算全部文档的相似度与汇总指标
+def evaluate_theta(true_theta, pred_theta, components=None, phi_matrix=None):
+    """
+    传入 components 与 phi_matrix 时先做主题对齐；否则按原始主题编号直接比较。
+    返回字典: aligned_theta (对齐后的 theta_pred)、similarities (逐文档余弦相似度)、
+    mean / std / median / min / max、permutation、topic_similarity。
+    """
+    pred_theta = np.asarray(pred_theta, dtype=np.float64)
+    K = pred_theta.shape[1]
+
+    if components is not None and phi_matrix is not None:
+        permutation, topic_similarity = align_topics(components, phi_matrix)
+    else:
+        permutation, topic_similarity = np.arange(K), None
+
+    aligned_theta = pred_theta[:, permutation]
+    similarities = row_cosine_similarity(true_theta, aligned_theta)
+
+    return {
+        'aligned_theta': aligned_theta,
+        'similarities': similarities,
+        'mean': float(similarities.mean()),
+        'std': float(similarities.std(ddof=1)) if len(similarities) > 1 else 0.0,
+        'median': float(np.median(similarities)),
+        'min': float(similarities.min()),
+        'max': float(similarities.max()),
+        'permutation': permutation,
+        'topic_similarity': topic_similarity,
+    }
+
+# 似然评估: 文档 d 的对数似然 log p(w_d) = sum_w n_dw * log(sum_k theta_dk * phi_kw)，
+# 按块计算 theta_chunk @ phi 的混合分布，只在非零词频处取对数，内存只与块大小有关
+
+# 训练 / 测试划分的随机数子序列编号 (与分片、参数扫描的子序列编号错开)
+SPLIT_STREAM = 2 ** 32 - 1
+# 文档补全时拆分测试文档词频的随机数子序列编号
+COMPLETION_STREAM = 2 ** 32 - 2
+
+#训练 / 测试划分: 返回长度 n_docs 的布尔数组 (True 为测试文档)，由 (seed, seed_stream) 唯一确定
+def split_test_mask(n_docs, test_fraction, seed, seed_stream=None):
+    mask = np.zeros(n_docs, dtype=bool)
+    n_test = int(round(n_docs * test_fraction))
+    if n_test == 0:
+        return mask
+    spawn_key = (SPLIT_STREAM,) if seed_stream is None else (seed_stream, SPLIT_STREAM)
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=spawn_key))
+    mask[rng.choice(n_docs, size=n_test, replace=False)] = True
+    return mask
+
+#把 CSR 矩阵按行切块
+def iter_row_chunks(dtm, chunk_size=EVAL_CHUNK_SIZE):
+    for start in range(0, dtm.shape[0], chunk_size):
+        yield dtm[start:start + chunk_size]
+
+#逐文档对数似然: dtm_chunks 为按文档顺序排列的 CSR 行块，theta 为 (N, K)，topics 为 (K, V) 主题-词分布
+def document_log_likelihood(dtm_chunks, theta, topics):
+    theta = np.asarray(theta, dtype=np.float64)
+    topics = np.asarray(topics, dtype=np.float64)
+    parts = []
+    start = 0
+    for chunk in dtm_chunks:
+        n_chunk = chunk.shape[0]
+        mixture = theta[start:start + n_chunk] @ topics
+        rows = np.repeat(np.arange(n_chunk), np.diff(chunk.indptr))
+        word_probs = np.maximum(mixture[rows, chunk.indices], np.finfo(np.float64).tiny) # 避免 log(0)
+        parts.append(np.bincount(rows, weights=chunk.data * np.log(word_probs), minlength=n_chunk))
+        start += n_chunk
+    return np.concatenate(parts) if parts else np.zeros(0)
+
+#二项稀疏 (binomial thinning): 每个非零词频 n 拆成 Binomial(n, 1/2) 与余下部分，返回 (观测一半, 留出一半) 两个 CSR 矩阵
+def split_document_counts(dtm, rng):
+    observed = dtm.copy()
+    observed.data = rng.binomial(dtm.data.astype(np.int64), 0.5).astype(dtm.dtype)
+    heldout = dtm.copy()
+    heldout.data = dtm.data - observed.data
+    return observed, heldout
+
+#固定主题-词分布推断文档-主题分布 (fold-in EM): theta_dk ∝ prior + theta_dk * sum_w n_dw * topics_kw / (theta_d @ topics)_w
+# 每篇文档收敛后不再更新，结果与分块方式无关
+def infer_theta(counts, topics, doc_topic_prior, max_iter=COMPLETION_MAX_ITER, tol=1e-6):
+    n_docs, K = counts.shape[0], topics.shape[0]
+    rows = np.repeat(np.arange(n_docs), np.diff(counts.indptr))
+    data = counts.data.astype(np.float64)
+    topics_nz = topics[:, counts.indices].T # (nnz, K)
+    theta = np.full((n_docs, K), 1.0 / K)
+    active = np.ones(n_docs, dtype=bool)
+    for _ in range(max_iter):
+        mixture = np.einsum('ik,ik->i', theta[rows], topics_nz)
+        ratio = sp.csr_matrix((data / np.maximum(mixture, np.finfo(np.float64).tiny), counts.indices, counts.indptr),
+                              shape=counts.shape)
+        updated = theta * (ratio @ topics.T) + doc_topic_prior
+        updated /= updated.sum(axis=1, keepdims=True)
+        changed = np.abs(updated - theta).max(axis=1, initial=0.0) >= tol
+        theta[active] = updated[active]
+        active &= changed
+        if not active.any():
+            break
+    return theta
+
+#文档补全: 测试文档的词频对半拆分，在一半上推断 theta，用另一半计算对数似然；真实模型在同一半上计算
+def document_completion(dtm_chunks, test_mask, topics, true_theta, phi_matrix, doc_topic_prior, rng):
+    log_likelihood, true_log_likelihood, token_count = [], [], []
+    start = 0
+    for chunk in dtm_chunks:
+        n_chunk = chunk.shape[0]
+        rows = np.flatnonzero(test_mask[start:start + n_chunk])
+        if len(rows):
+            observed, heldout = split_document_counts(chunk[rows], rng)
+            theta = infer_theta(observed, topics, doc_topic_prior)
+            log_likelihood.append(document_log_likelihood([heldout], theta, topics))
+            true_log_likelihood.append(document_log_likelihood([heldout], true_theta[start + rows], phi_matrix))
+            token_count.append(np.asarray(heldout.sum(axis=1)).ravel())
+        start += n_chunk
+    return np.concatenate(log_likelihood), np.concatenate(true_log_likelihood), np.concatenate(token_count)
+
+#困惑度: exp(-总对数似然 / 总词数)
+def perplexity(log_likelihood, token_counts):
+    total_tokens = float(np.sum(token_counts))
+    return float(np.exp(-np.sum(log_likelihood) / total_tokens)) if total_tokens > 0 else None
+
+#似然评估: 学到的模型与真实模型下的逐文档对数似然，以及测试集上的困惑度
+def evaluate_likelihood(make_chunks, theta_pred, components, true_theta, phi_matrix, test_mask=None, seed=None,
+                        seed_stream=None, doc_topic_prior=None):
+    """
+    make_chunks() 每次调用返回一个按文档顺序的 CSR 行块迭代器 (需要遍历多次)。
+    theta_pred 为 LDA 推断的文档-主题分布，与 components 的主题编号一致 (无需对齐)。
+    训练文档的对数似然为样本内估计 (theta_pred 与全部词频)。测试文档用文档补全 (document completion) 估计:
+    词频按 (seed, seed_stream) 二项稀疏对半拆分，在观测一半上固定 components 推断 theta (先验 doc_topic_prior，
+    默认与 sklearn 相同为 1/K)，只对留出一半计算对数似然，其 token_count 为留出一半的词数；
+    真实模型 (true_theta, phi_matrix) 在同一半上计算，二者可直接比较。
+    test_mask 为空或全 False 时没有留出数据，困惑度在全部文档上按样本内估计计算 (偏低)。
+    返回字典: log_likelihood / true_log_likelihood / token_count (逐文档)，
+    heldout_log_likelihood / heldout_perplexity / true_log_likelihood_total / true_perplexity (测试文档汇总)，
+    estimator ('document_completion' 或 'in_sample')，seconds 与 docs_per_sec (评估吞吐量)。
+    """
+    start = time.perf_counter()
+    topics = np.asarray(components, dtype=np.float64)
+    topics = topics / topics.sum(axis=1, keepdims=True)
+    theta_pred = np.asarray(theta_pred, dtype=np.float64)
+    theta_pred = theta_pred / theta_pred.sum(axis=1, keepdims=True)
+
+    log_likelihood = document_log_likelihood(make_chunks(), theta_pred, topics)
+    true_log_likelihood = document_log_likelihood(make_chunks(), true_theta, phi_matrix)
+    token_count = np.concatenate([np.asarray(chunk.sum(axis=1)).ravel() for chunk in make_chunks()])
+
+    if test_mask is None or not test_mask.any():
+        test_mask = np.ones(len(log_likelihood), dtype=bool)
+        estimator = 'in_sample'
+    else:
+        spawn_key = (COMPLETION_STREAM,) if seed_stream is None else (seed_stream, COMPLETION_STREAM)
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=spawn_key))
+        prior = 1.0 / topics.shape[0] if doc_topic_prior is None else doc_topic_prior
+        log_likelihood[test_mask], true_log_likelihood[test_mask], token_count[test_mask] = document_completion(
+            make_chunks(), test_mask, topics, np.asarray(true_theta), phi_matrix, prior, rng)
+        estimator = 'document_completion'
+    seconds = time.perf_counter() - start
+    return {
+        'log_likelihood': log_likelihood,
+        'true_log_likelihood': true_log_likelihood,
+        'token_count': token_count,
+        'heldout_log_likelihood': float(log_likelihood[test_mask].sum()),
+        'heldout_perplexity': perplexity(log_likelihood[test_mask], token_count[test_mask]),
+        'true_log_likelihood_total': float(true_log_likelihood[test_mask].sum()),
+        'true_perplexity': perplexity(true_log_likelihood[test_mask], token_count[test_mask]),
+        'estimator': estimator,
+        'seconds': seconds,
+        'docs_per_sec': len(log_likelihood) / seconds if seconds > 0 else None,
+    }
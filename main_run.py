@@ -1,60 +1,308 @@
-from config import K_TOPICS, V_SIZE, N_DOCS, ALPHA_PARAM, SIM_DATE, vocabulary, DOC_LENGTH
+from config import K_TOPICS, V_SIZE, N_DOCS, ALPHA_PARAM, DOC_LENGTH, build_vocabulary, current_sim_date, RANDOM_SEED, LDA_LEARNING_METHOD, ONLINE_BATCH_SIZE, GEN_SHARDS, TEST_FRACTION
 # 【修改点1】导入 initialize_database
-from db_manager import record_simulation_parameters, bulk_insert_documents, fetch_documents_for_analysis, bulk_insert_analysis_results, update_simulation_results, initialize_database
-from stat_sim import create_phi_matrix, generate_documents, train_and_predict_lda, calculate_cosine_similarity 
+from db_manager import record_simulation_parameters, stream_insert_documents, read_corpus, bulk_insert_analysis_results, update_simulation_results, initialize_database, db_session, transaction, fetch_run_summary, iter_dtm_batches, fetch_theta_matrix, update_run_status, find_corpus_run, link_corpus_run, insert_run_metrics, fetch_doc_ids, build_analysis_rows, update_run_likelihood, fetch_run_parameters, mark_stages_completed, fetch_completed_stages, count_documents, delete_run_rows
+from stat_sim import create_phi_matrix, iter_document_batches, train_and_predict_lda, train_lda_online, predict_lda_batches, resolve_seed
+from evaluation import evaluate_theta, split_test_mask, iter_row_chunks, evaluate_likelihood
+from corpus_cache import corpus_key, new_cache_stats, format_cache_stats, load_corpus, store_corpus, iter_corpus_batches
+from metrics import stage_timer, timed_batches, new_stage_record, format_metrics_summary
+from checkpoints import store_training_checkpoint, load_training_checkpoint, remove_training_checkpoint
 import numpy as np
-import json
-from sklearn.feature_extraction.text import CountVectorizer 
+
+#用户取消运行时抛出
+class RunCancelled(Exception):
+    pass
+
+#默认进度回调: 在每个批次边界打印进度
+def print_progress(stage, done, total):
+    if stage == 'generate':
+        print(f"    已生成并入库 {done} / {total} 篇文档")
+
+#完整模拟流程，main() 与 GUI 共用
+def run_pipeline(progress=print_progress, should_cancel=None):
+    """
+    progress(stage, done, total) 在各阶段与批次边界被调用，stage 为
+    'generate' / 'fetch' / 'train' / 'evaluate'；
+    should_cancel() 返回 True 时在下一个边界抛出 RunCancelled，并把该 run 标记为 aborted。
+    各阶段的用时与内存写入 run_metrics 表 (失败或取消的运行同样记录已完成的阶段)，并在结束时打印汇总。
+    返回 (run_id, 平均相似度)。
+    """
+    # 整个运行只使用一个调优过的连接，参数 / 分析结果 / 总分分别在显式事务中写入
+    metrics = []
+    with db_session() as conn:
+        print("--- LDA统计模拟项目启动 ---")
+        params = (K_TOPICS, V_SIZE, N_DOCS, ALPHA_PARAM, str(current_sim_date()))
+        seed = resolve_seed(RANDOM_SEED) # 记录实际使用的种子，便于复现
+        # 缓存键只由配置的种子决定: 未指定种子时语料无法被再次请求，不缓存也不在库中查找复用
+        key = corpus_key(K_TOPICS, V_SIZE, ALPHA_PARAM, N_DOCS, DOC_LENGTH, RANDOM_SEED, n_shards=GEN_SHARDS)
+        print("1. 记录实验参数...")
+        with stage_timer(metrics, 'params', n_rows=1), transaction(conn):
+            current_run_id = record_simulation_parameters(params, conn=conn, doc_length=DOC_LENGTH, seed=seed,
+                                                          corpus_key=key, gen_shards=GEN_SHARDS,
+                                                          test_fraction=TEST_FRACTION)
+            if current_run_id is not None:
+                mark_stages_completed(current_run_id, ['params'], conn=conn)
+
+        if current_run_id is None:
+            raise RuntimeError("无法获取 run_id，请检查数据库连接。")
+        print(f"[成功] Run ID: {current_run_id}")
+
+        # 之后的阶段只依赖库中记录的参数，与 resume_run 走同一条路径
+        run = fetch_run_parameters(current_run_id, conn=conn)
+        avg_similarity = _execute_run(conn, run, ['params'], progress, should_cancel, metrics)
+    return current_run_id, avg_similarity
+
+#续跑中断 (失败、取消或进程被杀) 的运行: 从第一个未完成的阶段开始，已入库的语料直接复用
+def resume_run(run_id, progress=print_progress, should_cancel=None):
+    """
+    已完成的阶段记录在 run_stages 表中: 文档已完整入库时跳过生成与入库 (phi 由参数重新构建)，
+    训练已完成且检查点文件仍在时跳过训练，分析结果已写入时只补写总分。
+    文档只写入了一部分时先删除这些行，再按记录的种子重新生成 (或从语料缓存读取)。
+    返回 (run_id, 平均相似度)。
+    """
+    metrics = []
+    with db_session() as conn:
+        run = fetch_run_parameters(run_id, conn=conn)
+        if run is None:
+            raise RuntimeError(f"run_id {run_id} 不存在。")
+        completed = fetch_completed_stages(run_id, conn=conn)
+        if 'score' in completed:
+            print(f"run_id {run_id} 已完成，无需续跑。")
+            return run_id, run['final_similarity_score']
+        if run['seed'] is None and 'documents' not in completed:
+            raise RuntimeError(f"run_id {run_id} 没有记录随机种子且文档未完整入库，无法续跑。")
+
+        print(f"--- 续跑 run_id {run_id}，已完成的阶段: {', '.join(completed) or '无'} ---")
+        with transaction(conn):
+            update_run_status(run_id, 'running', conn=conn)
+        avg_similarity = _execute_run(conn, run, completed, progress, should_cancel, metrics)
+    return run_id, avg_similarity
+
+#执行尚未完成的阶段；取消或出错时标记 run 状态，并写入本次执行的阶段指标
+def _execute_run(conn, run, completed, progress, should_cancel, metrics):
+    def report(stage, done, total):
+        progress(stage, done, total)
+        if should_cancel is not None and should_cancel():
+            raise RunCancelled("运行已被用户取消。")
+
+    current_run_id = run['run_id']
+    try:
+        avg_similarity = _run_stages(conn, run, completed, report, metrics)
+    except RunCancelled:
+        with transaction(conn):
+            update_run_status(current_run_id, 'aborted', conn=conn)
+        print(f"[取消] run_id {current_run_id} 已标记为 aborted")
+        raise
+    except Exception:
+        with transaction(conn):
+            update_run_status(current_run_id, 'failed', conn=conn)
+        raise
+    finally:
+        with transaction(conn):
+            insert_run_metrics(current_run_id, metrics, conn=conn)
+        print(f"\n--- run_id {current_run_id} 阶段用时 ---")
+        print(format_metrics_summary(metrics))
+    return avg_similarity
+
+def _run_stages(conn, run, completed, report, metrics):
+    # 参数全部取自 sim_parameters 行 (run)，新运行与续跑一致；旧数据缺少的列取 config 中的值
+    current_run_id = run['run_id']
+    K_topics, V_size, n_docs = run['K_topics'], run['V_size'], run['N_docs']
+    doc_length = run['doc_length'] if run['doc_length'] is not None else DOC_LENGTH
+    test_fraction = run['test_fraction'] if run['test_fraction'] is not None else TEST_FRACTION
+    vocabulary = build_vocabulary(V_size, K_topics)
+    cache_stats = new_cache_stats()
+    generated = False
+
+    if 'documents' in completed:
+        documents_run_id = run['documents_run_id']
+        print(f"\n2. run_id {documents_run_id} 的语料已入库，跳过生成与入库。")
+        phi_matrix = create_phi_matrix(K_topics, V_size)
+        report('generate', n_docs, n_docs)
+    else:
+        documents_run_id, phi_matrix, generated = _store_documents(conn, run, doc_length, vocabulary, cache_stats,
+                                                                   report, metrics)
+
+    if 'results' in completed:
+        print("\n3. 分析结果已写入，跳过训练与评估。")
+    else:
+        _train_and_evaluate(conn, run, completed, documents_run_id, phi_matrix, generated, test_fraction, vocabulary,
+                            report, metrics)
+
+    with stage_timer(metrics, 'score', n_rows=1), transaction(conn):
+        # 平均相似度直接在 SQL 中聚合
+        if not update_simulation_results(current_run_id, conn=conn):
+            raise RuntimeError(f"run_id {current_run_id} 平均相似度更新失败")
+        if not update_run_status(current_run_id, 'completed', conn=conn):
+            raise RuntimeError(f"run_id {current_run_id} 状态更新失败")
+        mark_stages_completed(current_run_id, ['score'], conn=conn)
+    remove_training_checkpoint(current_run_id)
+
+    summary = fetch_run_summary(current_run_id, conn=conn)
+    if summary is None:
+        raise RuntimeError(f"run_id {current_run_id} 没有分析结果")
+    print(f"   - 相似度: 均值 {summary['mean']:.4f}, 标准差 {summary['std']:.4f}, "
+          f"中位数 {summary['quantiles'][0.5]:.4f}")
+    print(f"   - {format_cache_stats(cache_stats)}")
+    return summary['mean']
+
+#阶段 documents: 复用库中的同一语料，或生成 (命中缓存时直接读取) 并流式入库；返回 (文档所在 run_id, phi, 是否新生成)
+def _store_documents(conn, run, doc_length, vocabulary, cache_stats, report, metrics):
+    current_run_id = run['run_id']
+    K_topics, V_size, n_docs, alpha = run['K_topics'], run['V_size'], run['N_docs'], run['alpha_param']
+    seed, key, n_shards = run['seed'], run['corpus_key'], run['gen_shards'] or 1
+    generated = False
+    # 上次中断时只入库了一部分的文档先删除，再完整地重新写入
+    if count_documents(current_run_id, conn=conn):
+        n_deleted = delete_run_rows('documents_data', current_run_id, conn=conn)
+        print(f"\n   - 删除上次未完成入库的 {n_deleted} 篇文档。")
+
+    # 相同参数与种子的语料只生成一次: 先找库中已有的同一语料，再找磁盘上的 .npz 缓存
+    documents_run_id = find_corpus_run(key, conn=conn)
+    if documents_run_id is not None:
+        cache_stats['hits'] += 1
+        print(f"\n2. 复用 run_id {documents_run_id} 已入库的语料，跳过生成与入库。")
+        phi_matrix = create_phi_matrix(K_topics, V_size)
+        with transaction(conn):
+            link_corpus_run(current_run_id, documents_run_id, conn=conn)
+            mark_stages_completed(current_run_id, ['documents'], conn=conn)
+        report('generate', n_docs, n_docs)
+    else:
+        documents_run_id = current_run_id
+        cached = load_corpus(key, stats=cache_stats)
+        if cached is not None:
+            print("\n2. 命中语料缓存，跳过生成，直接入库...")
+            phi_matrix = cached['phi']
+            batches = iter_corpus_batches(cached, current_run_id, vocabulary,
+                                          progress=lambda done, total: report('generate', done, total))
+        else:
+            print("\n2. 模拟数据生成并流式入库...")
+            generated = True
+            phi_matrix = create_phi_matrix(K_topics, V_size)
+            batches = iter_document_batches(phi_matrix, vocabulary, current_run_id, alpha, n_docs, doc_length, seed=seed,
+                                            progress=lambda done, total: report('generate', done, total),
+                                            n_shards=n_shards)
+        # 生成与入库交替进行: 产出批次的用时计入 generate，其余计入 insert
+        generate_record = new_stage_record('generate')
+        with stage_timer(metrics, 'insert', exclude=generate_record) as record, transaction(conn):
+            record['n_rows'] = stream_insert_documents(timed_batches(batches, generate_record), conn=conn)
+            if not record['n_rows']:
+                raise RuntimeError("文档入库失败。")
+            mark_stages_completed(current_run_id, ['documents'], conn=conn)
+    return documents_run_id, phi_matrix, generated
+
+#阶段 training 与 results: 训练 (或载入训练检查点)、对齐评估、似然评估并写入分析结果
+def _train_and_evaluate(conn, run, completed, documents_run_id, phi_matrix, generated, test_fraction, vocabulary,
+                        report, metrics):
+    current_run_id = run['run_id']
+    K_topics, V_size, n_docs = run['K_topics'], run['V_size'], run['N_docs']
+    seed, key = run['seed'], run['corpus_key']
+    checkpoint = load_training_checkpoint(current_run_id) if 'training' in completed else None
+
+    print("\n3. 验证阶段...")
+    # 训练 / 测试划分由种子决定: LDA 只在训练文档上拟合，再推断全部文档
+    if LDA_LEARNING_METHOD == 'online':
+        # 小批量训练: 每个 epoch 直接遍历数据库游标，不构建完整的文档-词频矩阵
+        def make_batches():
+            return iter_dtm_batches(documents_run_id, V_size, ONLINE_BATCH_SIZE, vocabulary, conn=conn)
+        test_ids = np.asarray(fetch_doc_ids(documents_run_id, conn=conn))
+        test_ids = test_ids[split_test_mask(len(test_ids), test_fraction, seed)]
+        def make_train_batches():
+            for batch_doc_ids, dtm_batch in make_batches():
+                keep = ~np.isin(batch_doc_ids, test_ids)
+                if keep.any():
+                    yield np.asarray(batch_doc_ids)[keep].tolist(), dtm_batch[keep]
+        n_train = n_docs - len(test_ids)
+        if checkpoint is not None:
+            print("   - 载入训练检查点，跳过训练。")
+            doc_ids, theta_pred_matrix, components = checkpoint['doc_ids'], checkpoint['theta_pred'], checkpoint['components']
+        else:
+            with stage_timer(metrics, 'train') as record:
+                lda_model, history = train_lda_online(make_train_batches, K_topics, n_train,
+                                                      progress=lambda epoch, total: report('train', epoch, total))
+                record['n_rows'] = n_train * len(history)
+            with stage_timer(metrics, 'predict', n_rows=n_docs):
+                doc_ids, theta_pred_matrix = predict_lda_batches(lda_model, make_batches())
+            components = lda_model.components_
+            _checkpoint_training(conn, current_run_id, doc_ids, theta_pred_matrix, components)
+        with stage_timer(metrics, 'fetch', n_rows=n_docs):
+            _, true_thetas = fetch_theta_matrix(documents_run_id, 'true', conn=conn)
+        test_mask = np.isin(doc_ids, test_ids)
+        def make_chunks():
+            return (dtm_batch for _, dtm_batch in make_batches())
+    else:
+        report('fetch', 0, 1)
+        # fetch 阶段包含从 BLOB 直接构建 CSR 文档-词频矩阵 (即向量化)
+        with stage_timer(metrics, 'fetch') as record:
+            doc_ids, true_thetas, dtm = read_corpus(documents_run_id, V_size, vocabulary, conn=conn)
+            record['n_rows'] = len(doc_ids)
+        print(f"   - 从数据库读取 {len(doc_ids)} 篇文档 (稀疏矩阵, {dtm.nnz} 个非零元素)。")
+        if generated and key is not None:
+            # 完整矩阵已在内存中，顺便写入缓存 (online 模式不构建完整矩阵，不写缓存)
+            with stage_timer(metrics, 'cache_store', n_rows=len(doc_ids)):
+                store_corpus(key, phi_matrix, true_thetas, dtm)
+        # 整体 (batch) 训练无法在迭代之间回调，只在训练前后报告进度
+        test_mask = split_test_mask(len(doc_ids), test_fraction, seed)
+        if checkpoint is not None:
+            print("   - 载入训练检查点，跳过训练。")
+            theta_pred_matrix, components = checkpoint['theta_pred'], checkpoint['components']
+        else:
+            train_dtm = dtm[~test_mask] if test_mask.any() else dtm
+            report('train', 0, 1)
+            with stage_timer(metrics, 'train', n_rows=train_dtm.shape[0]):
+                theta_pred_matrix, lda_model = train_and_predict_lda(train_dtm, dtm, K_topics, return_model=True)
+            components = lda_model.components_
+            _checkpoint_training(conn, current_run_id, doc_ids, theta_pred_matrix, components)
+        report('train', 1, 1)
+        def make_chunks():
+            return iter_row_chunks(dtm)
+    
+    # 先按 components_ 与 phi_matrix 对齐主题编号，再整体计算全部文档的余弦相似度
+    print("   - 对齐主题并计算相似度...")
+    report('evaluate', 0, 1)
+    with stage_timer(metrics, 'evaluate', n_rows=len(doc_ids)):
+        evaluation = evaluate_theta(true_thetas, theta_pred_matrix, components, phi_matrix)
+    print(f"   - 主题对齐: {evaluation['permutation'].tolist()}, "
+          f"主题-词分布相似度: {np.round(evaluation['topic_similarity'], 4).tolist()}")
+
+    # 测试集困惑度 (文档补全) 与真实模型 (phi_matrix, theta_true) 下的解析对数似然，按块遍历稀疏矩阵
+    print("   - 计算对数似然与困惑度...")
+    with stage_timer(metrics, 'likelihood', n_rows=len(doc_ids)):
+        likelihood = evaluate_likelihood(make_chunks, theta_pred_matrix, components,
+                                         true_thetas, phi_matrix, test_mask, seed=seed)
+    print(f"   - 测试集 ({int(test_mask.sum())} 篇) 困惑度: {likelihood['heldout_perplexity']:.2f}, "
+          f"真实模型困惑度: {likelihood['true_perplexity']:.2f}, "
+          f"评估吞吐量 {likelihood['docs_per_sec']:,.0f} docs/sec")
+    report('evaluate', 1, 1)
+
+    with stage_timer(metrics, 'write_results', n_rows=len(doc_ids)), transaction(conn):
+        analysis_results = build_analysis_rows(doc_ids, current_run_id, evaluation['aligned_theta'],
+                                               evaluation['similarities'], test_mask, likelihood)
+        # 写入失败时抛出异常使事务回滚，results 阶段不会被标记完成
+        if not bulk_insert_analysis_results(analysis_results, conn=conn):
+            raise RuntimeError(f"run_id {current_run_id} 分析结果写入失败")
+        if not update_run_likelihood(current_run_id, test_fraction, likelihood, conn=conn):
+            raise RuntimeError(f"run_id {current_run_id} 似然结果写入失败")
+        mark_stages_completed(current_run_id, ['results'], conn=conn)
+
+#训练结果写入检查点文件后再标记 training 阶段完成
+def _checkpoint_training(conn, run_id, doc_ids, theta_pred_matrix, components):
+    store_training_checkpoint(run_id, doc_ids, theta_pred_matrix, components)
+    with transaction(conn):
+        mark_stages_completed(run_id, ['training'], conn=conn)
 
 def main():
     # 【修改点2】确保数据库表存在
     print("--- 正在初始化环境 ---")
     initialize_database()
 
-    print("--- LDA统计模拟项目启动 ---")
-    params = (K_TOPICS, V_SIZE, N_DOCS, ALPHA_PARAM, str(SIM_DATE))
-    print("1. 记录实验参数...")
-    current_run_id = record_simulation_parameters(params)
-    
-    if current_run_id is None:
-        print("[失败] 无法获取 run_id")
-        return
-    
-    print(f"[成功] Run ID: {current_run_id}")
-    print("\n2. 模拟数据生成...")
-    phi_matrix = create_phi_matrix(K_TOPICS, V_SIZE)
-    generated_data = generate_documents(phi_matrix, vocabulary, current_run_id, ALPHA_PARAM, N_DOCS, DOC_LENGTH)
-    
-    print("\n3. 批量入库...")
-    if generated_data:
-        bulk_insert_documents(generated_data)
-    else:
+    try:
+        current_run_id, avg_similarity = run_pipeline()
+    except RuntimeError as e:
+        print(f"[失败] {e}")
         return
-
-    print("\n4. 验证阶段...")
-    analysis_data = fetch_documents_for_analysis(current_run_id)
-    texts = [d['text'] for d in analysis_data]
-    vectorizer = CountVectorizer(vocabulary=vocabulary) 
-    dtm = vectorizer.fit_transform(texts)
-    
-    theta_pred_matrix = train_and_predict_lda(dtm, dtm, K_TOPICS)
-    
-    analysis_results = []
-    print("   - 计算相似度...")
-    for i, doc_data in enumerate(analysis_data):
-        true_theta = doc_data['true_theta']     
-        pred_theta = theta_pred_matrix[i].tolist()
-        similarity = calculate_cosine_similarity(true_theta, pred_theta)
-        
-        result_tuple = (doc_data['doc_id'], current_run_id, json.dumps(pred_theta), similarity)
-        analysis_results.append(result_tuple)
-        
-    bulk_insert_analysis_results(analysis_results)
-    avg_similarity = np.mean([r[3] for r in analysis_results]) 
-    update_simulation_results(current_run_id, avg_similarity) 
     
     print(f"\n--- **项目最终验证结果** ---")
     print(f"**平均余弦相似度:** {avg_similarity:.4f}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
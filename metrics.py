@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from config import TRACE_PYTHON_MEMORY
+
+# resource 模块只在类 Unix 系统上可用，Windows 上不记录峰值 RSS
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 阶段计时: 记录每个流水线阶段的墙钟时间、CPU 时间、内存与处理行数，
+# 结果为字典列表，由 db_manager.insert_run_metrics 写入 run_metrics 表。
+# 内存有三项: rss_kb 为阶段结束时的常驻内存，rss_delta_kb 为本阶段内常驻内存的变化量 (可定位哪个阶段占用了内存)，
+# peak_rss_kb 为进程启动以来的峰值 (累计值，各阶段单调不减，不代表本阶段自身的峰值)
+
+#进程启动以来的峰值常驻内存 (KB)，不支持的平台返回 None
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+#当前常驻内存 (KB)，从 /proc/self/statm 读取；不支持的平台 (非 Linux) 返回 None
+def current_rss_kb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def _rss_delta(start, end):
+    return None if start is None or end is None else end - start
+
+#新的阶段记录
+def new_stage_record(stage):
+    return {
+        'stage': stage,
+        'wall_seconds': 0.0,
+        'cpu_seconds': 0.0,
+        'rss_kb': None,
+        'rss_delta_kb': None,
+        'peak_rss_kb': None,
+        'peak_traced_kb': None,
+        'n_rows': None,
+    }
+
+#阶段计时上下文: with stage_timer(metrics, 'train') as record: ...; record['n_rows'] = n
+@contextmanager
+def stage_timer(metrics, stage, n_rows=None, exclude=None):
+    """
+    退出时把该阶段的记录追加到 metrics (出现异常同样记录，便于定位失败阶段)。
+    exclude 为嵌套在本阶段内、单独计时的子阶段记录 (如 timed_batches 统计的生成时间)，
+    它先于本阶段写入 metrics，其用时与常驻内存变化量从本阶段中扣除。
+    TRACE_PYTHON_MEMORY 为 True 时额外用 tracemalloc 记录本阶段的 Python 内存峰值 (会拖慢运行)。
+    """
+    record = new_stage_record(stage)
+    record['n_rows'] = n_rows
+    if TRACE_PYTHON_MEMORY:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    rss_start = current_rss_kb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] = time.perf_counter() - wall_start
+        record['cpu_seconds'] = time.process_time() - cpu_start
+        record['rss_kb'] = current_rss_kb()
+        record['rss_delta_kb'] = _rss_delta(rss_start, record['rss_kb'])
+        record['peak_rss_kb'] = peak_rss_kb()
+        if TRACE_PYTHON_MEMORY:
+            record['peak_traced_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        if exclude is not None:
+            record['wall_seconds'] -= exclude['wall_seconds']
+            record['cpu_seconds'] -= exclude['cpu_seconds']
+            if record['rss_delta_kb'] is not None and exclude['rss_delta_kb'] is not None:
+                record['rss_delta_kb'] -= exclude['rss_delta_kb']
+            exclude['rss_kb'] = record['rss_kb']
+            exclude['peak_rss_kb'] = record['peak_rss_kb']
+            metrics.append(exclude)
+        metrics.append(record)
+
+#包装批次迭代器: 把产出每个批次的用时、常驻内存变化量与行数累计到 record 中
+def timed_batches(batches, record):
+    record['n_rows'] = 0
+    record['rss_delta_kb'] = 0
+    iterator = iter(batches)
+    while True:
+        rss_start = current_rss_kb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            record['wall_seconds'] += time.perf_counter() - wall_start
+            record['cpu_seconds'] += time.process_time() - cpu_start
+            delta = _rss_delta(rss_start, current_rss_kb())
+            record['rss_delta_kb'] = None if delta is None or record['rss_delta_kb'] is None \
+                else record['rss_delta_kb'] + delta
+        record['n_rows'] += len(batch)
+        yield batch
+
+#运行结束时打印的阶段汇总表
+def format_metrics_summary(metrics):
+    total_wall = sum(record['wall_seconds'] for record in metrics) or 1.0
+    lines = [f"{'阶段':<16}{'墙钟(s)':>10}{'CPU(s)':>10}{'占比':>8}{'行数':>10}{'行/秒':>12}"
+             f"{'RSS(MB)':>10}{'ΔRSS(MB)':>10}{'进程峰值(MB)':>14}"]
+    for record in metrics:
+        wall = record['wall_seconds']
+        n_rows = record['n_rows']
+        rate = f"{n_rows / wall:,.0f}" if n_rows and wall > 0 else "-"
+        rss = f"{record['rss_kb'] / 1024:.1f}" if record.get('rss_kb') is not None else "-"
+        delta = f"{record['rss_delta_kb'] / 1024:+.1f}" if record.get('rss_delta_kb') is not None else "-"
+        peak = f"{record['peak_rss_kb'] / 1024:.1f}" if record['peak_rss_kb'] is not None else "-"
+        lines.append(f"{record['stage']:<16}{wall:>10.3f}{record['cpu_seconds']:>10.3f}{wall / total_wall:>8.1%}"
+                     f"{n_rows if n_rows is not None else '-':>10}{rate:>12}{rss:>10}{delta:>10}{peak:>14}")
+    lines.append(f"{'总计':<16}{sum(record['wall_seconds'] for record in metrics):>10.3f}"
+                 f"{sum(record['cpu_seconds'] for record in metrics):>10.3f}")
+    return "\n".join(lines)
@@ -0,0 +1,171 @@
+import argparse
+import json
+import time
+from datetime import datetime
+import numpy as np
+
+from config import BOOTSTRAP_RESAMPLES, BOOTSTRAP_CHUNK_CELLS, CONFIDENCE_LEVEL
+from db_manager import (initialize_database, db_session, transaction, create_experiment, link_runs_to_experiment,
+                        update_experiment_results, fetch_experiment_runs, fetch_analysis_arrays)
+from stat_sim import resolve_seed
+from sweep import SWEEP_DEFAULTS, run_sweep
+
+# 重复实验 (Monte Carlo): 同一配置用不同的随机数流重复 R 次，各重复运行关联到同一个实验，
+# 再用整群自助法 (cluster bootstrap) 给出平均余弦相似度与测试集困惑度的置信区间
+
+#整群 (两阶段) 自助法重抽样: 先有放回地抽取 R 个重复，再在每个抽中的重复内有放回地抽取同样多的文档
+def iter_cluster_bootstrap_indices(group_sizes, n_boot, rng, chunk_cells=BOOTSTRAP_CHUNK_CELLS):
+    """
+    逐文档数组按重复连续排列，group_sizes 为各重复的文档数。
+    同一重复内的文档共享一个拟合的模型，彼此并不独立，只在文档层面重抽样会忽略重复之间的差异，置信区间过窄。
+    每块产出 (indices, valid)，indices 形状为 (块行数, R, n_max)，为合并数组中的下标；
+    各重复文档数不同时 valid 为同形状的掩码 (较短的重复以 False 补齐)，相同时为 None。
+    完整的索引矩阵在 B=10000, N=100000 时需要数 GB，按 chunk_cells 分块生成以限制内存。
+    """
+    group_sizes = np.asarray(group_sizes, dtype=np.int64)
+    n_groups, n_max = len(group_sizes), int(group_sizes.max())
+    index_dtype = np.int32 if group_sizes.sum() < np.iinfo(np.int32).max else np.int64
+    starts = (np.cumsum(group_sizes) - group_sizes).astype(index_dtype)
+    ragged = bool((group_sizes != n_max).any())
+    chunk_rows = max(1, chunk_cells // max(n_groups * n_max, 1))
+    for start in range(0, n_boot, chunk_rows):
+        rows = min(chunk_rows, n_boot - start)
+        picks = rng.integers(0, n_groups, size=(rows, n_groups))
+        valid = None
+        if ragged:
+            # 按各自的文档数抽取组内下标 (数组上界比标量上界慢，只在文档数不同时使用)
+            sizes = group_sizes[picks][..., None]
+            offsets = rng.integers(0, sizes, size=(rows, n_groups, n_max), dtype=index_dtype)
+            valid = np.arange(n_max) < sizes
+        else:
+            offsets = rng.integers(0, n_max, size=(rows, n_groups, n_max), dtype=index_dtype)
+        yield starts[picks][..., None] + offsets, valid
+
+#每个重抽样的总和 (只累加有效位置) 与有效文档数
+def _resampled_sums(values, indices, valid):
+    gathered = values[indices]
+    if valid is None:
+        return gathered.sum(axis=(1, 2))
+    return np.where(valid, gathered, 0.0).sum(axis=(1, 2))
+
+def _resampled_counts(indices, valid):
+    if valid is None:
+        return np.full(indices.shape[0], indices.shape[1] * indices.shape[2], dtype=np.float64)
+    return valid.sum(axis=(1, 2)).astype(np.float64)
+
+#百分位置信区间
+def percentile_interval(estimates, confidence=CONFIDENCE_LEVEL):
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(estimates, [tail, 100 - tail])
+    return float(low), float(high)
+
+#均值的自助法分布: 每个重抽样一行，整块做 gather + 求和；group_sizes 为 None 时视为一个重复 (普通的逐文档自助法)
+def bootstrap_mean(values, group_sizes=None, n_boot=BOOTSTRAP_RESAMPLES, seed=None, chunk_cells=BOOTSTRAP_CHUNK_CELLS):
+    values = np.asarray(values, dtype=np.float64)
+    group_sizes = [len(values)] if group_sizes is None else group_sizes
+    rng = np.random.default_rng(seed)
+    parts = [_resampled_sums(values, indices, valid) / _resampled_counts(indices, valid)
+             for indices, valid in iter_cluster_bootstrap_indices(group_sizes, n_boot, rng, chunk_cells)]
+    return np.concatenate(parts)
+
+#困惑度的自助法分布: 每个重抽样为 exp(-重抽样文档的对数似然之和 / 词数之和)
+def bootstrap_perplexity(log_likelihood, token_count, group_sizes=None, n_boot=BOOTSTRAP_RESAMPLES, seed=None,
+                         chunk_cells=BOOTSTRAP_CHUNK_CELLS):
+    log_likelihood = np.asarray(log_likelihood, dtype=np.float64)
+    token_count = np.asarray(token_count, dtype=np.float64)
+    group_sizes = [len(log_likelihood)] if group_sizes is None else group_sizes
+    rng = np.random.default_rng(seed)
+    parts = [np.exp(-_resampled_sums(log_likelihood, indices, valid) / _resampled_sums(token_count, indices, valid))
+             for indices, valid in iter_cluster_bootstrap_indices(group_sizes, n_boot, rng, chunk_cells)]
+    return np.concatenate(parts)
+
+#按 run_id 连续排列的逐文档数组中，各重复的文档数
+def _group_sizes(run_ids):
+    return np.unique(run_ids, return_counts=True)[1]
+
+#实验汇总: 对全部重复运行的逐文档结果做整群自助法，并给出重复之间的均值 / 标准差
+def summarize_experiment(experiment_id, n_boot=BOOTSTRAP_RESAMPLES, confidence=CONFIDENCE_LEVEL, seed=None,
+                         conn=None):
+    runs = fetch_experiment_runs(experiment_id, conn=conn)
+    arrays = fetch_analysis_arrays([run_id for run_id, _, _ in runs], conn=conn)
+    start = time.perf_counter()
+
+    similarity = arrays['similarity']
+    similarity_boot = bootstrap_mean(similarity, _group_sizes(arrays['run_id']), n_boot, seed)
+    results = {
+        'n_runs': len(runs),
+        'n_docs': int(len(similarity)),
+        'n_bootstrap': n_boot,
+        'bootstrap_method': 'cluster', # 先抽重复、再抽重复内的文档；只有一个重复时只反映文档层面的波动
+        'confidence': confidence,
+        'similarity_mean': float(similarity.mean()),
+        'similarity_ci': percentile_interval(similarity_boot, confidence),
+        'replicate_similarity': [score for _, score, _ in runs],
+    }
+
+    # 困惑度只在测试集文档上计算；没有划分时 (TEST_FRACTION = 0) 使用全部文档
+    mask = arrays['is_test'] if arrays['is_test'].any() else np.ones(len(similarity), dtype=bool)
+    mask &= ~np.isnan(arrays['log_likelihood'])
+    if mask.any():
+        log_likelihood, token_count = arrays['log_likelihood'][mask], arrays['token_count'][mask]
+        perplexity_boot = bootstrap_perplexity(log_likelihood, token_count, _group_sizes(arrays['run_id'][mask]),
+                                               n_boot, seed)
+        results['perplexity'] = float(np.exp(-log_likelihood.sum() / token_count.sum()))
+        results['perplexity_ci'] = percentile_interval(perplexity_boot, confidence)
+        results['replicate_perplexity'] = [perplexity for _, _, perplexity in runs]
+
+    replicate_scores = np.array([score for _, score, _ in runs], dtype=np.float64)
+    results['replicate_std'] = float(replicate_scores.std(ddof=1)) if len(runs) > 1 else 0.0
+    results['bootstrap_seconds'] = time.perf_counter() - start
+    return results
+
+#重复实验: 通过 sweep 在进程池中运行 R 个重复，关联到新实验并保存置信区间
+def run_replication(config, replicates, seed=None, n_boot=BOOTSTRAP_RESAMPLES, confidence=CONFIDENCE_LEVEL,
+                    max_workers=None, name=None):
+    """
+    第 r 个重复使用根种子 seed 下由 (配置, r) 决定的 SeedSequence 子序列 (见 sweep.task_seed_stream)，互相独立且可复现。
+    返回 (experiment_id, 汇总结果字典)。
+    """
+    seed = resolve_seed(seed)
+    full_config = dict(SWEEP_DEFAULTS)
+    full_config.update(config)
+    finished = run_sweep([full_config], replicates=replicates, seed=seed, max_workers=max_workers)
+
+    with db_session() as conn:
+        with transaction(conn):
+            experiment_id = create_experiment(name, full_config, replicates, seed, n_boot, confidence,
+                                              datetime.now().isoformat(timespec='seconds'), conn=conn)
+            link_runs_to_experiment(experiment_id, [run_id for _, _, run_id in finished], conn=conn)
+        results = summarize_experiment(experiment_id, n_boot, confidence, seed, conn=conn)
+        with transaction(conn):
+            update_experiment_results(experiment_id, results, conn=conn)
+
+    level = f"{confidence:.0%}"
+    print(f"\n--- 实验 {experiment_id}: {replicates} 次重复, {results['n_docs']} 篇文档 ---")
+    low, high = results['similarity_ci']
+    print(f"平均余弦相似度: {results['similarity_mean']:.4f}, {level} 置信区间 [{low:.4f}, {high:.4f}], "
+          f"重复间标准差 {results['replicate_std']:.4f}")
+    if 'perplexity' in results:
+        low, high = results['perplexity_ci']
+        print(f"测试集困惑度: {results['perplexity']:.2f}, {level} 置信区间 [{low:.2f}, {high:.2f}]")
+    print(f"自助法 B={n_boot}: 用时 {results['bootstrap_seconds']:.2f}s")
+    return experiment_id, results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="重复实验与自助法置信区间")
+    parser.add_argument('--config', default='{}', help="JSON 格式的配置覆盖，如 '{\"K_topics\": 10}'")
+    parser.add_argument('--replicates', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--bootstrap', type=int, default=BOOTSTRAP_RESAMPLES, help="重抽样次数 B")
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE_LEVEL)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--name', default=None)
+    args = parser.parse_args(argv)
+
+    initialize_database()
+    run_replication(json.loads(args.config), args.replicates, args.seed, args.bootstrap, args.confidence,
+                    args.workers, args.name)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,9 +1,18 @@
+import itertools
+import os
+import time
+import secrets
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import numpy as np
-from numpy.random import dirichlet
-from numpy.random import choice as np_choice
+from scipy.sparse import csr_matrix, vstack as sparse_vstack
 from numpy.linalg import norm 
-import json
-from sklearn.decomposition import LatentDirichletAllocation as LDA
+from config import apply_overrides, current_overrides, GEN_BLOCK_SIZE, GEN_SHARDS, GEN_WORKERS, STORAGE_MODE, LDA_N_JOBS, LDA_MAX_ITER, ONLINE_MAX_EPOCHS, LEARNING_DECAY, LEARNING_OFFSET, ONLINE_TOL
+from db_manager import encode_sparse_counts, encode_theta_rows
+
+# 生成器版本号: 生成算法或随机数抽取顺序改变时递增，使旧的语料缓存失效
+GENERATOR_VERSION = 2
 
 # 步骤 1:构建 Phi 矩阵 (词语-主题分布)
 def create_phi_matrix(K, V):
@@ -40,62 +49,252 @@ def create_phi_matrix(K, V):
 
 # 步骤 2: 文档生成函数 (使用 Phi 矩阵)
 
-def generate_documents(phi_matrix, vocabulary, run_id, alpha_param, n_docs, doc_length):
+#随机种子: None 时抽取一个新的 63 位种子 (可以写入 SQLite INTEGER 列)，以便记录后精确复现
+def resolve_seed(seed=None):
+    if seed is None:
+        return secrets.randbits(63)
+    return int(seed)
+
+#由 (seed, seed_stream) 构造 SeedSequence；seed_stream 为 SeedSequence(seed).spawn() 中的子序列编号
+def make_seed_sequence(seed, seed_stream=None):
+    if seed_stream is None:
+        return np.random.SeedSequence(seed)
+    return np.random.SeedSequence(seed, spawn_key=(seed_stream,))
+
+def _as_generator(seed):
+    """把 seed (None / int / SeedSequence / Generator) 统一转换为 numpy.random.Generator"""
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+#在内存中生成整个语料: 返回 (theta_true 矩阵, CSR 文档-词频矩阵)，不经过数据库
+def generate_count_matrix(phi_matrix, alpha_param, n_docs, doc_length, seed=None, block_size=GEN_BLOCK_SIZE):
+    rng = _as_generator(seed)
+    theta_parts, count_parts = [], []
+    for theta_block, counts in generate_count_blocks(phi_matrix, alpha_param, n_docs, doc_length, rng, block_size):
+        theta_parts.append(theta_block)
+        count_parts.append(csr_matrix(counts))
+    return np.vstack(theta_parts), sparse_vstack(count_parts, format='csr')
+
+def generate_token_blocks(phi_matrix, alpha_param, n_docs, doc_length, rng, block_size=GEN_BLOCK_SIZE):
     """
-    根据 LDA 的生成原理，生成 N_DOCS 篇文档和真实 theta 向量。
-    返回格式化后的数据列表，用于批量入库。
+    逐词生成引擎 (保留真实词序)：先为每个词位抽主题，再按主题的 Phi 抽词语。
+    与原始逐词循环的生成过程一致，但整块文档用累积分布 + searchsorted 一次完成。
+    逐块产出 (theta_true, word_indices)，word_indices 形状为 (块大小, doc_length)。
     """
-    all_documents_data = []
     K = phi_matrix.shape[0]
+    alpha_vector = np.full(K, alpha_param)
+    cum_phi = np.cumsum(phi_matrix, axis=1)
+
+    for start in range(0, n_docs, block_size):
+        n_block = min(block_size, n_docs - start)
+        theta_block = rng.dirichlet(alpha_vector, size=n_block)
+        cum_theta = np.cumsum(theta_block, axis=1)
+
+        # a) 抽主题: 均匀随机数落在哪个累积区间即为主题索引
+        u_topic = rng.random((n_block, doc_length))
+        topic_indices = (u_topic[:, :, None] >= cum_theta[:, None, :-1]).sum(axis=2)
+
+        # b) 抽词语: 按主题分组，在对应主题的累积 Phi 上查找
+        u_word = rng.random((n_block, doc_length))
+        word_indices = np.empty((n_block, doc_length), dtype=np.int64)
+        for k in range(K):
+            mask = topic_indices == k
+            word_indices[mask] = np.searchsorted(cum_phi[k, :-1], u_word[mask], side='right')
+
+        yield theta_block, word_indices
+
+def generate_count_blocks(phi_matrix, alpha_param, n_docs, doc_length, rng, block_size=GEN_BLOCK_SIZE):
+    """
+    批量生成引擎：每次处理 block_size 篇文档，逐块产出 (theta_true, counts)。
+    counts 形状为 (块大小, V)，即该块的文档-词频矩阵。
+
+    给定 theta 时，文档的词频服从以混合分布 theta @ phi 为参数的多项分布。
+    文档较长 (doc_length >= V) 时直接对混合分布做一次 multinomial 抽样；
+    文档较短时多项抽样要逐个词做二项分解，反而更慢，改为逐词抽样后用 bincount 汇总。
+    """
+    K, V = phi_matrix.shape
+    alpha_vector = np.full(K, alpha_param)
+
+    if doc_length < V:
+        for theta_block, word_indices in generate_token_blocks(phi_matrix, alpha_param, n_docs, doc_length, rng, block_size):
+            n_block = theta_block.shape[0]
+            # 每行加上行偏移，一次 bincount 得到整块的词频矩阵
+            offsets = np.arange(n_block)[:, None] * V
+            counts = np.bincount((word_indices + offsets).ravel(), minlength=n_block * V).reshape(n_block, V)
+            yield theta_block, counts
+        return
+
+    for start in range(0, n_docs, block_size):
+        n_block = min(block_size, n_docs - start)
+        theta_block = rng.dirichlet(alpha_vector, size=n_block)
+
+        # 混合分布: 每篇文档在 V 个词上的概率，再次归一化以消除浮点误差
+        mixture = theta_block @ phi_matrix
+        mixture /= mixture.sum(axis=1, keepdims=True)
+
+        counts = rng.multinomial(doc_length, mixture)
+        yield theta_block, counts
+
+#分片边界: 把 n_docs 篇文档尽量均匀地分成 n_shards 个连续区间
+def shard_bounds(n_docs, n_shards):
+    edges = np.linspace(0, n_docs, n_shards + 1).astype(int)
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+#工作进程: 从共享内存读取 phi，按分片自己的 SeedSequence 生成该分片的 (theta, CSR 词频矩阵)
+def _generate_shard(shm_name, phi_shape, phi_dtype, alpha_param, n_docs, doc_length, seed_sequence, block_size):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        phi_matrix = np.ndarray(phi_shape, dtype=phi_dtype, buffer=shm.buf)
+        result = generate_count_matrix(phi_matrix, alpha_param, n_docs, doc_length,
+                                       seed=np.random.default_rng(seed_sequence), block_size=block_size)
+        del phi_matrix # 关闭共享内存前释放对其缓冲区的引用
+        return result
+    finally:
+        shm.close()
+
+#并行生成: 按分片顺序产出 (theta, CSR 词频矩阵)
+def generate_shards(phi_matrix, alpha_param, n_docs, doc_length, seed, n_shards=GEN_SHARDS, max_workers=GEN_WORKERS,
+                    seed_stream=None, block_size=GEN_BLOCK_SIZE):
+    """
+    第 i 个分片使用 make_seed_sequence(seed, seed_stream).spawn(n_shards)[i] 作为随机数流，
+    因此生成结果只由 (seed, seed_stream, n_shards) 决定，与进程数和完成顺序无关。
+    phi 通过 shared_memory 共享给工作进程，不随每个任务序列化复制。
+    同时提交的分片数不超过进程数，取走一个分片的结果后才提交下一个，
+    父进程中最多同时保留 (进程数 + 1) 个分片的结果，内存随 N / n_shards 增长 (而不是随 N)。
+    """
+    if not isinstance(seed, (int, np.integer)):
+        raise ValueError("并行生成需要整数种子 (Generator 无法拆分为可复现的分片)")
+    children = make_seed_sequence(seed, seed_stream).spawn(n_shards)
+    bounds = shard_bounds(n_docs, n_shards)
+
+    shm = shared_memory.SharedMemory(create=True, size=phi_matrix.nbytes)
+    try:
+        shared_phi = np.ndarray(phi_matrix.shape, dtype=phi_matrix.dtype, buffer=shm.buf)
+        shared_phi[:] = phi_matrix
+        in_flight = max_workers or os.cpu_count() or 1
+        shards = iter(zip(bounds, children))
+        # 分片所需的参数全部随任务传入；initializer 再把运行时覆盖同步到工作进程
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=apply_overrides,
+                                 initargs=(current_overrides(),)) as executor:
+            def submit_next():
+                for (start, stop), child in itertools.islice(shards, 1):
+                    futures.append(executor.submit(_generate_shard, shm.name, phi_matrix.shape, phi_matrix.dtype,
+                                                   alpha_param, stop - start, doc_length, child, block_size))
+            futures = deque()
+            for _ in range(in_flight):
+                submit_next()
+            # 按分片编号依次取出，保证输出顺序固定；取出后立即释放 future，不保留已产出的结果
+            while futures:
+                result = futures.popleft().result()
+                submit_next()
+                yield result
+                del result
+        del shared_phi
+    finally:
+        shm.close()
+        shm.unlink()
+
+#并行生成引擎: 把各分片的结果按 block_size 切块，产出格式与 generate_count_blocks 相同
+def generate_sharded_count_blocks(phi_matrix, alpha_param, n_docs, doc_length, seed, n_shards=GEN_SHARDS,
+                                  max_workers=GEN_WORKERS, block_size=GEN_BLOCK_SIZE):
+    for theta, dtm in generate_shards(phi_matrix, alpha_param, n_docs, doc_length, seed, n_shards, max_workers,
+                                      block_size=block_size):
+        for start in range(0, theta.shape[0], block_size):
+            stop = start + block_size
+            yield theta[start:stop], dtm[start:stop].toarray()
+
+def iter_document_batches(phi_matrix, vocabulary, run_id, alpha_param, n_docs, doc_length,
+                          exact_order=False, seed=None, block_size=GEN_BLOCK_SIZE, storage_mode=STORAGE_MODE,
+                          progress=None, n_shards=1, max_workers=GEN_WORKERS):
+    """
+    流式生成：每生成一块 (block_size 篇) 文档就产出一批入库数据元组，内存占用只与块大小有关。
+    progress(已生成数, 总数) 在每个批次边界被调用。
+
+    exact_order=False (默认): 使用批量词频引擎，文本中的词按词表顺序排列，
+        词频与逐词生成同分布 (词袋模型不依赖词序)。
+    exact_order=True: 使用逐词引擎，保留每个词位的真实生成顺序。
+    storage_mode='sparse': 只保存稀疏词频 BLOB，不拼接文本；
+    storage_mode='text': 保存空格分隔的文本 (旧格式)。
+    n_shards > 1: 用 max_workers 个进程并行生成 n_shards 个分片 (见 generate_shards)，只支持批量词频引擎；
+        注意分片生成与单进程生成使用不同的随机数流，复现时需要相同的分片数。
+    """
+    if n_shards > 1 and exact_order:
+        raise ValueError("并行生成只支持批量词频引擎 (exact_order=False)")
     V = phi_matrix.shape[1]
-    
-    # 1. 核心统计抽样: 从 Dirichlet 分布中抽取真实主题比例向量 (theta_true)
-    true_theta_vectors = dirichlet([alpha_param] * K, size=n_docs)
-    
-    for i in range(n_docs):
-        theta_true = true_theta_vectors[i]
-        document_words = []
-        
-        # 2. 循环生成文档中的每个词语
-        for _ in range(doc_length):
-            # a) 抽主题: 根据文档的 theta_true 比例，从 K 个主题中抽取一个主题索引
-            topic_index = np_choice(np.arange(K), p=theta_true)
-            
-            # b) 抽词语: 根据被抽中的主题的 Phi 概率，从 V 个词汇中抽取一个词语索引
-            word_index = np_choice(np.arange(V), p=phi_matrix[topic_index, :])
-            word = vocabulary[word_index]
-            
-            document_words.append(word)
-            
-        # 3. 组装数据，准备入库
-        simulated_text = " ".join(document_words)
-        
-        # 将 numpy 数组转换为列表，再转换为 JSON 字符串，SQLite只能存储文本、整数等，不能存Numpy数组
-        theta_json = json.dumps(theta_true.tolist())
-        
-        # 数据元组格式: (run_id, simulated_text, theta_json)
-        all_documents_data.append((
-            run_id,
-            simulated_text,
-            theta_json
-        ))
-        
-        if (i + 1) % 500 == 0:
-            print(f"    已生成 {i + 1} / {n_docs} 篇文档")
+    word_ids = np.arange(V)
+    sparse = storage_mode == 'sparse'
+    n_done = 0
+
+    if n_shards > 1:
+        blocks = generate_sharded_count_blocks(phi_matrix, alpha_param, n_docs, doc_length, seed, n_shards,
+                                               max_workers, block_size)
+    elif exact_order:
+        blocks = generate_token_blocks(phi_matrix, alpha_param, n_docs, doc_length, _as_generator(seed), block_size)
+    else:
+        blocks = generate_count_blocks(phi_matrix, alpha_param, n_docs, doc_length, _as_generator(seed), block_size)
+
+    for theta_block, block in blocks:
+        batch = []
+        # SQLite 不能直接存 Numpy 数组，theta 按整块编码为二进制 BLOB
+        theta_blobs = encode_theta_rows(theta_block)
+        for theta_blob, doc in zip(theta_blobs, block):
+            if sparse:
+                counts = np.bincount(doc, minlength=V) if exact_order else doc
+                simulated_text = None
+                word_counts = encode_sparse_counts(counts)
+            else:
+                # 词频模式下把词频展开为按词表排序的词序列
+                word_indices = doc if exact_order else np.repeat(word_ids, doc)
+                simulated_text = " ".join([vocabulary[w] for w in word_indices.tolist()])
+                word_counts = None
+
+            # 数据元组格式: (run_id, simulated_text, theta_blob, word_counts)
+            batch.append((
+                run_id,
+                simulated_text,
+                theta_blob,
+                word_counts
+            ))
+
+        n_done += len(batch)
+        if progress is not None:
+            progress(n_done, n_docs)
+        yield batch
+
+def print_generation_progress(n_done, n_docs):
+    print(f"    已生成 {n_done} / {n_docs} 篇文档")
+
+def generate_documents(phi_matrix, vocabulary, run_id, alpha_param, n_docs, doc_length,
+                       exact_order=False, seed=None, block_size=GEN_BLOCK_SIZE, storage_mode=STORAGE_MODE):
+    """
+    根据 LDA 的生成原理，生成 N_DOCS 篇文档和真实 theta 向量。
+    返回格式化后的数据列表，用于批量入库。参数含义见 iter_document_batches。
+    大规模模拟请直接把 iter_document_batches 交给 db_manager.stream_insert_documents，避免整表驻留内存。
+    """
+    all_documents_data = []
+    for batch in iter_document_batches(phi_matrix, vocabulary, run_id, alpha_param, n_docs, doc_length,
+                                       exact_order, seed, block_size, storage_mode,
+                                       progress=print_generation_progress):
+        all_documents_data.extend(batch)
 
     print("文档生成完成。")
     return all_documents_data
     
 # 步骤 3: 模型训练与推
-def train_and_predict_lda(dtm, data_dtm, K_topics):    
+def train_and_predict_lda(dtm, data_dtm, K_topics, return_model=False, n_jobs=LDA_N_JOBS, max_iter=LDA_MAX_ITER):
+    """return_model=True 时返回 (theta_pred_matrix, lda_model)，供主题对齐使用 lda_model.components_"""
+    # sklearn 导入较慢，只在真正训练时导入
+    from sklearn.decomposition import LatentDirichletAllocation as LDA
     # 1. 配置LDA 模型
     lda_model = LDA(n_components=K_topics, 
-                    max_iter=10, #最大迭代次数
+                    max_iter=max_iter, #最大迭代次数
                     learning_method='batch', #模型学习方法
+                    n_jobs=n_jobs, #并行 E 步使用的进程数
                     random_state=42) #随机种子，保证实验结果可重复可比较。
     
     # 2. 训练模型 
-    print("正在训练 LDA 模型 (K=5)")
+    print(f"正在训练 LDA 模型 (K={K_topics})")
     lda_model.fit(dtm)
     
     # 3. 推断主题分布 (theta_pred)
@@ -104,8 +303,66 @@ def train_and_predict_lda(dtm, data_dtm, K_topics):
     
     print("模型训练完成。")
 
+    if return_model:
+        return theta_pred_matrix, lda_model
     return theta_pred_matrix
 
+# 步骤 3b: 小批量 (online) 训练，数据按批次从数据库流式读入
+def train_lda_online(make_batches, K_topics, n_docs, max_epochs=ONLINE_MAX_EPOCHS,
+                     learning_decay=LEARNING_DECAY, learning_offset=LEARNING_OFFSET,
+                     tol=ONLINE_TOL, n_jobs=LDA_N_JOBS, progress=None):
+    """
+    make_batches() 每次调用返回一个新的批次迭代器 (如 db_manager.iter_dtm_batches)，
+    批次元素为 (doc_ids, dtm_batch)。每个 epoch 遍历一次全部批次并逐批 partial_fit，
+    完整的文档-词频矩阵不会出现在内存中。
+    相邻两个 epoch 的主题-词分布相对变化小于 tol 时提前停止。
+    progress(epoch, max_epochs) 在每个 epoch 结束时调用。
+    返回 (lda_model, history)，history 为每个 epoch 的 {'epoch', 'seconds', 'n_batches', 'change'}。
+    """
+    from sklearn.decomposition import LatentDirichletAllocation as LDA
+    lda_model = LDA(n_components=K_topics,
+                    learning_method='online',
+                    learning_decay=learning_decay,
+                    learning_offset=learning_offset,
+                    total_samples=n_docs, #每个小批量按全体文档数缩放更新量
+                    n_jobs=n_jobs, #并行 E 步
+                    random_state=42)
+
+    print(f"正在以小批量方式训练 LDA 模型 (K={K_topics}, 文档数={n_docs})")
+    history = []
+    previous_topics = None
+    for epoch in range(1, max_epochs + 1):
+        start = time.perf_counter()
+        n_batches = 0
+        for _, dtm_batch in make_batches():
+            lda_model.partial_fit(dtm_batch)
+            n_batches += 1
+        seconds = time.perf_counter() - start
+
+        topics = lda_model.components_ / lda_model.components_.sum(axis=1, keepdims=True)
+        change = None if previous_topics is None else norm(topics - previous_topics) / norm(previous_topics)
+        previous_topics = topics
+
+        history.append({'epoch': epoch, 'seconds': seconds, 'n_batches': n_batches, 'change': change})
+        change_text = "--" if change is None else f"{change:.2e}"
+        print(f"    epoch {epoch}/{max_epochs}: {n_batches} 个批次, 用时 {seconds:.2f}s, 主题变化 {change_text}")
+        if progress is not None:
+            progress(epoch, max_epochs)
+        if change is not None and change < tol:
+            print(f"    主题变化小于 {tol}，提前收敛。")
+            break
+
+    print("模型训练完成。")
+    return lda_model, history
+
+#逐批推断主题分布，结果按批次顺序拼接为 (N, K) 矩阵
+def predict_lda_batches(lda_model, batches):
+    doc_ids, theta_parts = [], []
+    for batch_doc_ids, dtm_batch in batches:
+        doc_ids.extend(batch_doc_ids)
+        theta_parts.append(lda_model.transform(dtm_batch))
+    return doc_ids, np.vstack(theta_parts)
+
 # 步骤 4: 余弦相似度计算函数
 
 def calculate_cosine_similarity(vec_a, vec_b):
@@ -0,0 +1,201 @@
+import hashlib
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+from config import (K_TOPICS, V_SIZE, N_DOCS, ALPHA_PARAM, DOC_LENGTH, TEST_FRACTION, GEN_BLOCK_SIZE, EVAL_CHUNK_SIZE, LDA_MAX_ITER,
+                    CORPUS_CACHE_DIR, CORPUS_CACHE_MAX_BYTES, current_sim_date, apply_overrides, current_overrides)
+from db_manager import (initialize_database, db_session, transaction, record_simulation_parameters,
+                        stream_insert_documents, bulk_insert_analysis_results, update_simulation_results,
+                        update_run_status, find_completed_run, fetch_doc_ids, encode_sparse_rows, encode_theta_rows,
+                        build_analysis_rows, update_run_likelihood, mark_stages_completed, RUN_STAGES)
+from stat_sim import create_phi_matrix, generate_count_matrix, train_and_predict_lda, make_seed_sequence, resolve_seed
+from evaluation import evaluate_theta, split_test_mask, iter_row_chunks, evaluate_likelihood
+from corpus_cache import corpus_key, new_cache_stats, load_corpus, store_corpus
+
+# 参数扫描: 多个配置 x 多次重复，在进程池中并行模拟，由主进程统一写库
+
+# 每个配置包含的参数及其默认值 (取自 config)
+SWEEP_DEFAULTS = {
+    'K_topics': K_TOPICS,
+    'V_size': V_SIZE,
+    'N_docs': N_DOCS,
+    'alpha_param': ALPHA_PARAM,
+    'doc_length': DOC_LENGTH,
+}
+
+# 写库时每批插入的文档数
+WRITE_BATCH_SIZE = 1000
+
+#网格展开: {'K_topics': [5, 10], 'alpha_param': [0.1, 0.5]} -> 4 个配置字典 (未给出的参数取默认值)
+def expand_grid(grid):
+    keys = list(grid)
+    configs = []
+    for values in itertools.product(*(grid[key] for key in keys)):
+        config = dict(SWEEP_DEFAULTS)
+        config.update(zip(keys, values))
+        configs.append(config)
+    return configs
+
+#随机数流编号: 由配置参数与重复编号的哈希决定 (取 60 位，可存入 SQLite INTEGER)，
+# 与网格中的其他配置及其顺序无关，增删网格取值后已完成的任务仍能被识别
+def task_seed_stream(config, replicate):
+    payload = {key: float(config[key]) if key == 'alpha_param' else int(config[key]) for key in SWEEP_DEFAULTS}
+    payload['replicate'] = int(replicate)
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+    return int(digest[:15], 16)
+
+#任务列表: 每个 (配置, 重复) 一个任务，使用 SeedSequence(seed, spawn_key=(task_seed_stream(...),)) 的随机数流
+# 影响结果的设置 (测试集比例、生成块大小、训练迭代次数、缓存目录、评估块大小) 由主进程写入任务，工作进程只从任务中读取，
+# 因此 spawn 启动的工作进程与主进程的 corpus_key 和划分始终一致；cache_corpus 为 False 时 (未指定根种子) 不生成缓存键
+def build_tasks(configs, replicates, seed, cache_corpus=True):
+    tasks = []
+    for config in configs:
+        full_config = dict(SWEEP_DEFAULTS)
+        full_config.update(config)
+        for replicate in range(replicates):
+            seed_stream = task_seed_stream(full_config, replicate)
+            tasks.append({
+                'config': full_config,
+                'replicate': replicate,
+                'seed': seed,
+                'seed_stream': seed_stream,
+                'corpus_key': corpus_key(full_config['K_topics'], full_config['V_size'], full_config['alpha_param'],
+                                         full_config['N_docs'], full_config['doc_length'], seed, seed_stream,
+                                         block_size=GEN_BLOCK_SIZE) if cache_corpus else None,
+                'test_fraction': TEST_FRACTION,
+                'block_size': GEN_BLOCK_SIZE,
+                'lda_max_iter': LDA_MAX_ITER,
+                'eval_chunk_size': EVAL_CHUNK_SIZE,
+                'cache_dir': CORPUS_CACHE_DIR,
+                'cache_max_bytes': CORPUS_CACHE_MAX_BYTES,
+            })
+    return tasks
+
+#工作进程: 在内存中完成生成、训练与评估，不接触数据库
+def simulate_task(task):
+    config = task['config']
+    start = time.perf_counter()
+    # 并行度由进程池提供，每个进程内的 BLAS 限制为单线程，避免超额订阅
+    with threadpool_limits(limits=1):
+        # 同一语料 (相同参数、种子与子序列) 只生成一次，之后从 .npz 缓存读取
+        cache_stats = new_cache_stats()
+        cached = load_corpus(task['corpus_key'], task['cache_dir'], stats=cache_stats)
+        if cached is not None:
+            phi_matrix, true_theta, dtm = cached['phi'], cached['theta'], cached['dtm']
+        else:
+            phi_matrix = create_phi_matrix(config['K_topics'], config['V_size'])
+            rng = np.random.default_rng(make_seed_sequence(task['seed'], task['seed_stream']))
+            true_theta, dtm = generate_count_matrix(phi_matrix, config['alpha_param'], config['N_docs'],
+                                                    config['doc_length'], seed=rng, block_size=task['block_size'])
+            store_corpus(task['corpus_key'], phi_matrix, true_theta, dtm, task['cache_dir'], task['cache_max_bytes'])
+        test_mask = split_test_mask(config['N_docs'], task['test_fraction'], task['seed'], task['seed_stream'])
+        train_dtm = dtm[~test_mask] if test_mask.any() else dtm
+        theta_pred, lda_model = train_and_predict_lda(train_dtm, dtm, config['K_topics'], return_model=True, n_jobs=1,
+                                                      max_iter=task['lda_max_iter'])
+        evaluation = evaluate_theta(true_theta, theta_pred, lda_model.components_, phi_matrix)
+        likelihood = evaluate_likelihood(lambda: iter_row_chunks(dtm, task['eval_chunk_size']), theta_pred,
+                                         lda_model.components_,
+                                         true_theta, phi_matrix, test_mask, seed=task['seed'],
+                                         seed_stream=task['seed_stream'])
+
+    return {
+        'task': task,
+        'dtm': dtm,
+        'true_theta': true_theta,
+        'aligned_theta': evaluation['aligned_theta'],
+        'similarities': evaluation['similarities'],
+        'test_mask': test_mask,
+        'likelihood': likelihood,
+        'cache_stats': cache_stats,
+        'seconds': time.perf_counter() - start,
+    }
+
+#主进程写库: 一个任务的参数、文档、分析结果与总分在同一个事务中写入
+def write_task_result(conn, result):
+    task = result['task']
+    config = task['config']
+    params = (config['K_topics'], config['V_size'], config['N_docs'], config['alpha_param'], str(current_sim_date()))
+    with transaction(conn):
+        run_id = record_simulation_parameters(params, conn=conn, doc_length=config['doc_length'],
+                                              seed=task['seed'], seed_stream=task['seed_stream'],
+                                              corpus_key=task['corpus_key'])
+        if run_id is None:
+            raise RuntimeError("无法获取 run_id")
+
+        count_blobs = encode_sparse_rows(result['dtm'])
+        theta_blobs = encode_theta_rows(result['true_theta'])
+        rows = [(run_id, None, theta_blob, count_blob) for theta_blob, count_blob in zip(theta_blobs, count_blobs)]
+        batches = (rows[i:i + WRITE_BATCH_SIZE] for i in range(0, len(rows), WRITE_BATCH_SIZE))
+        if stream_insert_documents(batches, checkpoint_every=None, conn=conn) is None:
+            raise RuntimeError(f"run_id {run_id} 文档入库失败")
+
+        doc_ids = fetch_doc_ids(run_id, conn=conn)
+        analysis_results = build_analysis_rows(doc_ids, run_id, result['aligned_theta'], result['similarities'],
+                                               result['test_mask'], result['likelihood'])
+        # 任一写入失败都抛出异常回滚整个任务，不会留下没有结果的 completed 运行
+        if not bulk_insert_analysis_results(analysis_results, conn=conn):
+            raise RuntimeError(f"run_id {run_id} 分析结果写入失败")
+        if not update_simulation_results(run_id, conn=conn):
+            raise RuntimeError(f"run_id {run_id} 平均相似度更新失败")
+        if not update_run_likelihood(run_id, task['test_fraction'], result['likelihood'], conn=conn):
+            raise RuntimeError(f"run_id {run_id} 似然结果写入失败")
+        if not update_run_status(run_id, 'completed', conn=conn):
+            raise RuntimeError(f"run_id {run_id} 状态更新失败")
+        # 整个任务在一个事务中写入，全部阶段一起标记完成
+        mark_stages_completed(run_id, RUN_STAGES, conn=conn)
+    return run_id
+
+def run_sweep(configs, replicates=1, seed=None, max_workers=None):
+    """
+    configs 为配置字典列表 (可由 expand_grid 生成)，每个配置重复 replicates 次。
+    seed 为整个扫描的根种子；用同一个 seed 与同一组配置重新调用时，已完成的任务会被跳过 (断点续跑)。
+    返回 [(配置, 重复编号, run_id)]。
+    """
+    cache_corpus = seed is not None
+    seed = resolve_seed(seed)
+    initialize_database()
+    tasks = build_tasks(configs, replicates, seed, cache_corpus)
+    print(f"--- 参数扫描: {len(configs)} 个配置 x {replicates} 次重复, 根种子 {seed} ---")
+
+    finished = []
+    pending = []
+    with db_session() as conn:
+        for task in tasks:
+            config = task['config']
+            run_id = find_completed_run(config['K_topics'], config['V_size'], config['N_docs'], config['alpha_param'],
+                                        config['doc_length'], task['seed'], task['seed_stream'], conn=conn)
+            if run_id is None:
+                pending.append(task)
+            else:
+                finished.append((config, task['replicate'], run_id))
+        if finished:
+            print(f"跳过 {len(finished)} 个已完成的任务。")
+
+        start = time.perf_counter()
+        # 其余设置 (LDA 参数等) 通过 initializer 同步到工作进程
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=apply_overrides,
+                                 initargs=(current_overrides(),)) as executor:
+            futures = [executor.submit(simulate_task, task) for task in pending]
+            for n_done, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                task = result['task']
+                run_id = write_task_result(conn, result)
+                finished.append((task['config'], task['replicate'], run_id))
+                print(f"    [{n_done}/{len(pending)}] run_id {run_id}: {task['config']} 重复 {task['replicate']}, "
+                      f"平均相似度 {result['similarities'].mean():.4f}, "
+                      f"测试集困惑度 {result['likelihood']['heldout_perplexity']:.2f} "
+                      f"(评估 {result['likelihood']['docs_per_sec']:,.0f} docs/sec), 用时 {result['seconds']:.2f}s, "
+                      f"语料缓存{'命中' if result['cache_stats']['hits'] else '未命中'}")
+
+    if pending:
+        elapsed = time.perf_counter() - start
+        print(f"参数扫描完成: {len(pending)} 个任务, 总用时 {elapsed:.2f}s")
+    return finished
+
+if __name__ == "__main__":
+    grid = {'K_topics': [5], 'alpha_param': [0.1, 0.5, 1.0], 'N_docs': [1000]}
+    run_sweep(expand_grid(grid), replicates=2, seed=2024)